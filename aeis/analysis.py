@@ -0,0 +1,139 @@
+"""
+Analyze AEIS columns with the analyzer for their file.
+"""
+from __future__ import absolute_import
+
+import logging
+import os
+import pprint
+import sys
+
+from . import registry
+from .artifact import AnalysisArtifact
+from .store import AnalysisStore, migrate_shelf, shelf_exists
+
+
+logger = logging.getLogger('aeis')
+
+
+def get_analyzer(aeis_file):
+    """
+    Get an appropriate analyzer for the file.
+    """
+    analyzer = registry.resolve(aeis_file.root_name, aeis_file.year)
+    if not analyzer:
+        raise RuntimeError(
+            'You must register an analyzer for "%s" to parse "%s"' % (
+                aeis_file.root_name, aeis_file
+            ))
+
+    return analyzer
+
+
+def reload_analyzers():
+    """
+    Reload the analyzers module, after editing it, and forget the
+    analyzers resolved from it.
+    """
+    from . import analyzers
+    reload(analyzers)
+    registry.clear()
+    return analyzers
+
+
+class AnalysisError(ValueError):
+    """
+    An analyzer failed to decompose `column` past `remainder`.
+    """
+    def __init__(self, message, column, remainder, position):
+        super(AnalysisError, self).__init__(message)
+        self.column = column
+        self.remainder = remainder
+        self.position = position
+
+
+def analyze_column(aeis_file, column, analyzer, metadata):
+    column_metadata = metadata.get(column, {})
+    column_metadata['decomposition'] = []
+    pretty_metadata = pprint.pformat(column_metadata)
+    analysis = {'metadata': column_metadata}
+
+    position = 0
+    remainder = column
+    try:
+        for partial, data in analyzer(aeis_file, remainder):
+            logger.debug('partial: %r', repr(partial))
+            logger.debug('data: %r', repr(data))
+            try:
+                analysis.update(data)
+            except ValueError:
+                message = 'Analyzer %r yielded invalid data:\n%s' % (
+                    analyzer.func_name,
+                    pprint.pformat(data)
+                )
+                raise AnalysisError(message, column, remainder, position)
+
+            # Record decomposition
+            column_metadata['decomposition'].append((partial, data))
+
+            # Determine continuation from the partial value
+            if partial == remainder:
+                remainder = None
+                break
+            elif not remainder.startswith(partial):
+                message = (
+                    'Invalid partial %r for remainder %r of %r' +
+                    ' in position %d'
+                )
+                message %= (partial, remainder, column, position)
+                message += '\nMetadata: %r' % pretty_metadata
+                raise AnalysisError(message, column, remainder, position)
+
+            # Remove partial data from remainder
+            remainder = remainder.replace(partial, '', 1)
+            position += len(partial)
+    except AnalysisError:
+        raise
+    except Exception as e:
+        # Keep the original traceback, but report where the analyzer was
+        message = '%s for remainder %r of %r in position %d: %s'
+        message %= (type(e).__name__, remainder, column, position, e)
+        error = AnalysisError(message, column, remainder, position)
+        raise error, None, sys.exc_info()[2]
+
+    # If there is a remainder after the generator stops, raise an
+    # exception because we didn't parse all metadata from the field.
+    if remainder:
+        message = 'Could not parse remainder %r of %r in position %d'
+        message %= (remainder, column, position)
+        message += '\nMetadata: %r' % pretty_metadata
+        raise AnalysisError(message, column, remainder, position)
+
+    return analysis
+
+
+def get_or_create_analysis(root):
+    store = AnalysisStore('analysis.db')
+
+    # Migrate analyses from the shelf that previously stored them
+    if not len(store) and shelf_exists('analysis.shelf'):
+        migrate_shelf('analysis.shelf', store)
+
+    return store
+
+
+def get_analysis(root):
+    """
+    Get analysis for reading, preferring the precomputed artifact unless
+    the analyses have changed since it was built.
+    """
+    if os.path.exists('analysis.bin'):
+        if not os.path.exists('analysis.db') or \
+                os.path.getmtime('analysis.db') <= \
+                os.path.getmtime('analysis.bin'):
+            return AnalysisArtifact('analysis.bin')
+
+        logger.warning('analysis.bin is older than analysis.db, so it is '
+                       'ignored; rebuild it with `make artifact`')
+
+    return get_or_create_analysis(root)
@@ -30,6 +30,8 @@ import re
 import shelve
 import sre_constants
 
+from . import instrument
+from .analysis import get_analysis, get_or_create_analysis  # noqa
 from .files import get_files
 from .fields import get_columns, get_extra_metadata
 
@@ -281,6 +283,8 @@ def analyzer(analyze_function):
     where `evidence` is the substring of the column that determined the
     analysis in the `metadata` dict.
     """
+    name = analyze_function.__name__
+
     @functools.wraps(analyze_function)
     def analyze(aeis_file, column):
         yield '', {'version': aeis_file.year}
@@ -363,13 +367,21 @@ def analyzer(analyze_function):
                 yield remainder, {'field': 'accountability-rating'}
 
             # Finally we get to the file-specific analyzer
-            for partial, data in analyze_function(aeis_file, remainder):
+            profiler = instrument.profiler
+            iter_analysis = analyze_function(aeis_file, remainder)
+            if profiler:
+                iter_analysis = profiler.timed(name, iter_analysis)
+            for partial, data in iter_analysis:
                 yield partial, data
                 remainder = remainder.replace(partial, '', 1)
 
             # Parse remaining 2013 numerator/denominator measures first
             if aeis_file.year == 2013 and len(remainder) == 1:
-                measure = parse_2013_measure(remainder, column[1:])
+                if profiler:
+                    measure = profiler.call(name, parse_2013_measure,
+                                            remainder, column[1:])
+                else:
+                    measure = parse_2013_measure(remainder, column[1:])
                 if measure:
                     yield remainder, {'measure': measure}
                     remainder = ''
@@ -420,10 +432,38 @@ def analyzer_dsl(get_dsl):
     2. `metadata` is a dict that is yielded as a result of matching the rule
     3. `rules` are additional rules that may be applied after stripping the
        remainder of the parent rule.
+
+    DSL trees may only depend on the year of the file, so each is built on
+    first use for a year and reused, along with its compiled regexes.
     """
+    name = get_dsl.__name__
+    trees = {}
+    patterns = {}
+
+    def get_tree(aeis_file):
+        try:
+            return trees[aeis_file.year]
+        except KeyError:
+            tree = trees[aeis_file.year] = get_dsl(aeis_file)
+            return tree
+
+    def get_pattern(transition):
+        try:
+            return patterns[transition]
+        except KeyError:
+            try:
+                pattern = re.compile(r'^' + transition, re.X)
+            except sre_constants.error:
+                raise ValueError(
+                    'r"{}" is not a valid regex'.format(transition)
+                )
+            patterns[transition] = pattern
+            return pattern
+
     @functools.wraps(get_dsl)
     def analyze(aeis_file, remainder):
-        tree = get_dsl(aeis_file)
+        profiler = instrument.profiler
+        tree = get_tree(aeis_file)
         items = tree.iteritems()
 
         # We will continue to walk our DSL tree until we've parsed the
@@ -435,12 +475,14 @@ def analyzer_dsl(get_dsl):
                 break
 
             # Get a match object for a possible regex transition
-            try:
-                match = re.match(r'^' + transition, remainder, re.X)
-            except sre_constants.error:
-                raise ValueError(
-                    'r"{}" is not a valid regex'.format(transition)
-                )
+            if profiler:
+                start = instrument.timer()
+            match = get_pattern(transition).match(remainder)
+            if profiler:
+                profiler.time(name, 'regex', transition,
+                              instrument.timer() - start)
+                profiler.count(name, transition, matched=bool(
+                    match or remainder.startswith(transition)))
 
             # First try to transition via literal prefix
             if remainder.startswith(transition):
@@ -484,7 +526,11 @@ def analyzer_dsl(get_dsl):
                         # The partial may be parsed by a function, which
                         # may in turn require the entire remainder as
                         # context to determine the correct value.
-                        value = dict_or_callable(partial, remainder)
+                        if profiler:
+                            value = profiler.call(name, dict_or_callable,
+                                                  partial, remainder)
+                        else:
+                            value = dict_or_callable(partial, remainder)
                         yield partial, {key: value}
                     else:
                         try:
@@ -515,6 +561,8 @@ def analyzer_dsl(get_dsl):
             # Trim the partial string that we analyzed
             remainder = remainder.replace(partial, '', 1)
 
+    # Expose the DSL to tools that inspect it, like benchmarks
+    analyze.get_dsl = get_dsl
     return analyze
 
 
@@ -1199,11 +1247,6 @@ def analyze_comp(aeis_file):
     )}
 
 
-analyze_tasa = analyze_taas
-analyze_tasb = analyze_taas
-analyze_tasc = analyze_taas
-
-
 @analyzer
 @analyzer_dsl
 def analyze_taks(aeis_file):
@@ -1251,23 +1294,6 @@ def analyze_taks(aeis_file):
     }
 
 
-# Met Standard
-analyze_taks1 = analyze_taks
-
-# Met Standard and Commended
-analyze_taks2 = analyze_taks
-
-# Sum of Grades 10-11, TAKS-M Met Standard
-analyze_taks3 = analyze_taks
-
-# Progress of TAKS Failers, Texas Success Initiative
-analyze_taks4 = analyze_taks
-
-# Progress of Prior Year TAKS Failers, Percent Passing TAKS, Eng Lang Arts
-# District, region, and state only
-analyze_taks5 = analyze_taks
-
-
 @analyzer
 # @analyzer_dsl
 def analyze_taks_2013(aeis_file, remainder):
@@ -1275,13 +1301,6 @@ def analyze_taks_2013(aeis_file, remainder):
     yield remainder, {}
 
 
-analyze_taks1_2013 = analyze_taks_2013
-analyze_taks2_2013 = analyze_taks_2013
-analyze_taks3_2013 = analyze_taks_2013
-analyze_taks4_2013 = analyze_taks_2013
-analyze_taks5_2013 = analyze_taks_2013
-
-
 @analyzer
 @analyzer_dsl
 def analyze_part1_2013(aeis_file):
@@ -1318,9 +1337,6 @@ def analyze_part1_2013(aeis_file):
     }
 
 
-analyze_part2_2013 = analyze_part1_2013
-
-
 @analyzer
 @analyzer_dsl
 def analyze_perf_2013(aeis_file):
@@ -1620,14 +1636,6 @@ def analyze_staar(aeis_file, remainder):
     yield remainder, {}
 
 
-analyze_staar1 = analyze_staar
-analyze_staar2 = analyze_staar
-analyze_staar3 = analyze_staar
-analyze_staar4 = analyze_staar
-analyze_staar5 = analyze_staar
-analyze_staar6 = analyze_staar
-
-
 # TODO: Move to metadata.py
 def get_or_create_metadata(root):
     if os.path.exists('metadata.shelf'):
@@ -1644,11 +1652,3 @@ def get_or_create_metadata(root):
     get_extra_metadata(root, metadata)
 
     return metadata
-
-
-# TODO: Move to analysis.py
-def get_or_create_analysis(root):
-    if os.path.exists('analysis.shelf'):
-        return dict(shelve.open('analysis.shelf'))
-
-    return shelve.open('analysis.shelf')
@@ -0,0 +1,167 @@
+"""
+A compact, memory-mappable file of precomputed column analyses.
+
+The file starts with a fixed header, followed by a table of fixed-size
+entries sorted by column name, the column names themselves, and the
+analyses encoded as JSON:
+
+    header   magic, format version, count, keys offset, values offset
+    entries  (key offset, key length, value offset, value length) * count
+    keys     UTF-8 column names, in sorted order
+    values   JSON analyses
+
+Lookups binary search the entries in place, so opening the file costs
+nothing and only the analyses that are used are ever decoded.
+
+Usage:
+
+    $ python -m aeis.artifact build analysis.db analysis.bin
+    $ python -m aeis.artifact get analysis.bin DH00A00T013R
+"""
+from __future__ import absolute_import
+
+import json
+import mmap
+import os
+import pprint
+import struct
+import sys
+
+from .store import AnalysisStore, to_json
+
+
+MAGIC = 'AEISANLS'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQ')
+ENTRY = struct.Struct('<IHQI')
+
+
+def write_artifact(path, items):
+    """
+    Write (column, analysis) pairs to an artifact file at `path`.
+    """
+    entries = []
+    keys = []
+    values = []
+    key_offset = value_offset = 0
+    encoded_items = ((k.encode('utf-8'), a) for k, a in items)
+    for key, analysis in sorted(encoded_items, key=lambda item: item[0]):
+        value = json.dumps(analysis, default=to_json, sort_keys=True)
+        entries.append(ENTRY.pack(key_offset, len(key),
+                                  value_offset, len(value)))
+        keys.append(key)
+        values.append(value)
+        key_offset += len(key)
+        value_offset += len(value)
+
+    keys_start = HEADER.size + ENTRY.size * len(entries)
+    values_start = keys_start + key_offset
+    header = HEADER.pack(MAGIC, VERSION, len(entries), keys_start,
+                         values_start)
+
+    # Replace any existing artifact atomically
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as f:
+        f.write(header)
+        f.write(''.join(entries))
+        f.write(''.join(keys))
+        f.write(''.join(values))
+    os.rename(temporary_path, path)
+
+
+class AnalysisArtifact(object):
+    """
+    A read-only, dict-like view of an artifact file.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.count, self.keys_start, self.values_start = \
+            HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not an analysis artifact' % path)
+        elif version != VERSION:
+            raise ValueError('%s has version %d, expected %d' % (
+                path, version, VERSION))
+
+    def __repr__(self):
+        return '<AnalysisArtifact %s of %d columns>' % (self.path, self.count)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, key):
+        index = self._find(key)
+        if index is None:
+            raise KeyError(key)
+
+        return json.loads(self._get_value(index))
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def iterkeys(self):
+        for index in xrange(self.count):
+            yield self._get_key(index).decode('utf-8')
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def iteritems(self):
+        for index in xrange(self.count):
+            key = self._get_key(index).decode('utf-8')
+            yield key, json.loads(self._get_value(index))
+
+    def close(self):
+        self.map.close()
+
+    def _get_entry(self, index):
+        return ENTRY.unpack_from(self.map, HEADER.size + ENTRY.size * index)
+
+    def _get_key(self, index):
+        key_offset, key_length, _, _ = self._get_entry(index)
+        start = self.keys_start + key_offset
+        return self.map[start:start + key_length]
+
+    def _get_value(self, index):
+        _, _, value_offset, value_length = self._get_entry(index)
+        start = self.values_start + value_offset
+        return self.map[start:start + value_length]
+
+    def _find(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            middle_key = self._get_key(middle)
+            if middle_key < key:
+                low = middle + 1
+            elif middle_key > key:
+                high = middle
+            else:
+                return middle
+
+        return None
+
+
+if __name__ == '__main__':
+    command = sys.argv[1]
+    if command == 'build':
+        store_path, artifact_path = sys.argv[2:4]
+        write_artifact(artifact_path, AnalysisStore(store_path).iteritems())
+        print AnalysisArtifact(artifact_path)
+    elif command == 'get':
+        pprint.pprint(AnalysisArtifact(sys.argv[2])[sys.argv[3]])
@@ -0,0 +1,382 @@
+"""
+Index bulk actions into Elasticsearch in parallel.
+
+Actions are generated and serialized for one task (like an AEIS file) at
+a time by a pool of worker processes, and grouped into chunks of at most
+`chunk_size` actions and `max_chunk_bytes` bytes. Several sender threads
+then send the chunks with one client, sharing its connection pool.
+
+`get_actions(task, start)` yields the `(row, action)` of each action of
+a task, where row is the offset of the record the action comes from, and
+actions before the `start` row may be left out. Each chunk is sent with
+its position in its task, so that a `Checkpoint` can be advanced as
+chunks are acknowledged. Requests and items that fail for lack of
+resources are retried with exponential backoff, and items that still
+fail are written to `DeadLetters`, if any (see `aeis/checkpoints.py`).
+
+    >>> es = Elasticsearch(ES_HOST, maxsize=4)
+    >>> throughput = index_parallel(es, get_actions, files, jobs=4,
+    ...                             threads=4)
+    >>> print throughput
+    <Throughput 120000 docs, 24.1 MB in 10.0s: 12000 docs/s, 2.4 MB/s, 0 errors>
+"""
+from __future__ import absolute_import
+
+import json
+import logging
+import multiprocessing
+import Queue
+import threading
+import time
+import timeit
+import traceback
+
+from elasticsearch.helpers import BulkIndexError, expand_action
+
+from .checkpoints import get_key
+
+
+logger = logging.getLogger('aeis')
+timer = timeit.default_timer
+
+CHUNK_SIZE = 500
+MAX_CHUNK_BYTES = 10 * 1024 * 1024
+
+# How often to log throughput, in seconds
+REPORT_INTERVAL = 10
+
+# How often to retry a request or its items, and how long to wait before
+# the first retry, in seconds
+RETRIES = 3
+BACKOFF = 1.0
+
+# Item statuses worth retrying, because the cluster was too busy
+RETRY_STATUSES = (429, 503)
+
+# Bulk operations that are followed by a source line
+SOURCE_OP_TYPES = ('index', 'create', 'update')
+
+
+def serialize(action):
+    """
+    Serialize an action as the lines of a bulk request, unless it is
+    serialized already.
+    """
+    if isinstance(action, basestring):
+        return action
+
+    meta, source = expand_action(action)
+    lines = json.dumps(meta) + '\n'
+    if source is not None:
+        lines += json.dumps(source) + '\n'
+    return lines
+
+
+def iter_chunks(actions, chunk_size=CHUNK_SIZE,
+                max_chunk_bytes=MAX_CHUNK_BYTES):
+    """
+    Group the (row, lines) of serialized actions into (count, body, row)
+    chunks of at most `chunk_size` actions and, unless an action is
+    larger on its own, `max_chunk_bytes` bytes, where row is that of the
+    chunk's last action.
+    """
+    chunk = []
+    chunk_bytes = 0
+    row = None
+    for action_row, line in actions:
+        if chunk and (len(chunk) >= chunk_size or
+                      chunk_bytes + len(line) > max_chunk_bytes):
+            yield len(chunk), ''.join(chunk), row
+            chunk = []
+            chunk_bytes = 0
+
+        chunk.append(line)
+        chunk_bytes += len(line)
+        row = action_row
+
+    if chunk:
+        yield len(chunk), ''.join(chunk), row
+
+
+def iter_task_chunks(get_actions, task, start=0, chunk_size=CHUNK_SIZE,
+                     max_chunk_bytes=MAX_CHUNK_BYTES):
+    """
+    Yield the (count, body, position) chunks of a task, where position
+    is the (key, seq, row, last) of the chunk in its task. A task without
+    actions still has an empty last chunk.
+    """
+    key = get_key(task)
+    actions = ((row, serialize(a)) for row, a in get_actions(task, start))
+    seq = 0
+    previous = None
+    for chunk in iter_chunks(actions, chunk_size, max_chunk_bytes):
+        if previous is not None:
+            count, body, row = previous
+            yield count, body, (key, seq, row, False)
+            seq += 1
+        previous = chunk
+
+    count, body, row = previous or (0, '', start)
+    yield count, body, (key, seq, row, True)
+
+
+def produce(get_actions, tasks, chunks, chunk_size, max_chunk_bytes):
+    """
+    Put chunks of the actions for each (task, start) from the `tasks`
+    queue in the `chunks` queue, until a task is None. Errors are put as
+    (None, traceback, None), and None is put when done.
+    """
+    try:
+        for task, start in iter(tasks.get, None):
+            for chunk in iter_task_chunks(get_actions, task, start,
+                                          chunk_size, max_chunk_bytes):
+                chunks.put(chunk)
+    except Exception:
+        chunks.put((None, traceback.format_exc(), None))
+    finally:
+        chunks.put(None)
+
+
+def split_actions(body):
+    """
+    Split the body of a bulk request into the lines of each action.
+    """
+    lines = iter(body.splitlines(True))
+    for line in lines:
+        if not line.strip():
+            continue
+
+        (op_type, meta), = json.loads(line).items()
+        if op_type in SOURCE_OP_TYPES:
+            line += next(lines)
+        yield line
+
+
+def is_ok(item):
+    """
+    Whether an item of a bulk response succeeded. Deleting a document
+    that's already gone is fine.
+    """
+    (op_type, result), = item.items()
+    status = result.get('status', 500)
+    return 200 <= status < 300 or (op_type == 'delete' and status == 404)
+
+
+class Throughput(object):
+    def __init__(self):
+        self.docs = 0
+        self.bytes = 0
+        self.errors = 0
+        self.start = timer()
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        elapsed = self.elapsed
+        return ('<Throughput %d docs, %.1f MB in %.1fs: '
+                '%.0f docs/s, %.1f MB/s, %d errors>') % (
+            self.docs, self.bytes / 1e6, elapsed, self.docs / elapsed,
+            self.bytes / 1e6 / elapsed, self.errors)
+
+    @property
+    def elapsed(self):
+        return max(timer() - self.start, 1e-9)
+
+    def add(self, docs, bytes, errors=0):
+        with self.lock:
+            self.docs += docs
+            self.bytes += bytes
+            self.errors += errors
+
+
+class BulkSender(object):
+    """
+    Send bulk chunks from a bounded queue with several threads.
+
+    Chunks are acknowledged to the `checkpoint` once all their items were
+    indexed or, if there are `dead_letters`, written there. Once a request
+    fails for good, the others are dropped, and the failure is raised.
+    """
+    def __init__(self, es, threads=4, raise_on_error=True, checkpoint=None,
+                 dead_letters=None, retries=RETRIES, backoff=BACKOFF):
+        self.es = es
+        self.raise_on_error = raise_on_error
+        self.checkpoint = checkpoint
+        self.dead_letters = dead_letters
+        self.retries = retries
+        self.backoff = backoff
+        self.throughput = Throughput()
+        self.queue = Queue.Queue(maxsize=2 * threads)
+        self.errors = []
+        self.failure = None
+        self.threads = [threading.Thread(target=self.run)
+                        for _ in range(threads)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def send(self, count, body, position=None):
+        self.queue.put((count, body, position))
+
+    def run(self):
+        for count, body, position in iter(self.queue.get, None):
+            if self.failure is not None:
+                continue
+
+            try:
+                failures = self.send_chunk(count, body) if count else []
+            except Exception as e:
+                logger.exception('bulk request failed')
+                self.failure = self.failure or e
+                continue
+            self.throughput.add(count, len(body), errors=len(failures))
+
+            if failures and self.dead_letters is not None:
+                self.dead_letters.write(position and position[0], failures)
+            elif failures:
+                self.errors.extend(item for item, lines in failures)
+                continue
+
+            if self.checkpoint is not None and position is not None:
+                self.checkpoint.ack(position)
+
+    def send_chunk(self, count, body):
+        """
+        Send a chunk, retrying it or its busy items, and return the (item,
+        lines) of the items that failed. Requests that still fail raise.
+        """
+        failures = []
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+            try:
+                response = self.es.bulk(body=body)
+            except Exception as e:
+                if attempt < self.retries:
+                    logger.warning('bulk request failed, retrying: %s', e)
+                    continue
+                raise
+
+            items = response['items']
+            if all(is_ok(item) for item in items):
+                return failures
+
+            retries = []
+            for item, lines in zip(items, split_actions(body)):
+                if is_ok(item):
+                    continue
+                elif item.values()[0].get('status') in RETRY_STATUSES and \
+                        attempt < self.retries:
+                    retries.append(lines)
+                else:
+                    failures.append((item, lines))
+
+            if not retries:
+                return failures
+            logger.warning('retrying %d busy items', len(retries))
+            body = ''.join(retries)
+
+        return failures
+
+    def stop(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def close(self):
+        self.stop()
+        if self.failure is not None:
+            raise self.failure
+        if self.errors and self.raise_on_error:
+            raise BulkIndexError('%i document(s) failed to index.' %
+                                 len(self.errors), self.errors)
+
+
+def index_parallel(es, get_actions, tasks, jobs=4, threads=4,
+                   chunk_size=CHUNK_SIZE, max_chunk_bytes=MAX_CHUNK_BYTES,
+                   raise_on_error=True, checkpoint=None, dead_letters=None):
+    """
+    Index the actions of each task, generated by `jobs` processes and
+    sent by `threads` threads, and return the `Throughput`. With a
+    `checkpoint`, tasks that are done are skipped, and the others start
+    from their checkpointed rows.
+    """
+    sender = BulkSender(es, threads=threads, raise_on_error=raise_on_error,
+                        checkpoint=checkpoint, dead_letters=dead_letters)
+    last_report = timer()
+
+    starts = []
+    for task in tasks:
+        start = checkpoint.get_start(get_key(task)) if checkpoint else 0
+        if start is not None:
+            starts.append((task, start))
+
+    if jobs <= 1:
+        chunks = (chunk for task, start in starts
+                  for chunk in iter_task_chunks(get_actions, task, start,
+                                                chunk_size, max_chunk_bytes))
+        workers = []
+    else:
+        task_queue = multiprocessing.Queue()
+        for task_start in starts:
+            task_queue.put(task_start)
+        for _ in range(jobs):
+            task_queue.put(None)
+
+        chunk_queue = multiprocessing.Queue(maxsize=4 * jobs)
+        workers = [
+            multiprocessing.Process(
+                target=produce,
+                args=(get_actions, task_queue, chunk_queue, chunk_size,
+                      max_chunk_bytes))
+            for _ in range(jobs)
+        ]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        chunks = iter_queue(chunk_queue, len(workers))
+
+    try:
+        for count, body, position in chunks:
+            if count is None:
+                raise RuntimeError('Worker failed:\n%s' % body)
+
+            if sender.failure is not None:
+                raise sender.failure
+
+            sender.send(count, body, position)
+            if timer() - last_report > REPORT_INTERVAL:
+                logger.info(sender.throughput)
+                last_report = timer()
+    except BaseException:
+        for worker in workers:
+            worker.terminate()
+        sender.failure = sender.failure or RuntimeError('Stopped')
+        sender.stop()
+        if checkpoint is not None:
+            checkpoint.save()
+        raise
+
+    for worker in workers:
+        worker.join()
+    try:
+        sender.close()
+    finally:
+        if checkpoint is not None:
+            checkpoint.save()
+    logger.info(sender.throughput)
+    return sender.throughput
+
+
+def iter_queue(queue, n_producers):
+    """
+    Yield items from a queue until each producer has put None.
+    """
+    finished = 0
+    while finished < n_producers:
+        item = queue.get()
+        if item is None:
+            finished += 1
+        else:
+            yield item
@@ -0,0 +1,101 @@
+"""
+Memoize column analyses across files and years.
+
+Many columns repeat across files that share an analyzer, so analyses are
+cached by analyzer identity, year and column name. The analyzer identity
+includes a digest of the analyzer module's source, which invalidates any
+persisted analyses as soon as the analyzers change. It is computed once
+per analyzer, so a reloaded analyzer gets a new identity.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import os
+import shelve
+import sys
+import weakref
+
+
+_digests = {}
+_identities = weakref.WeakKeyDictionary()
+
+
+def get_module_digest(module):
+    path = module.__file__
+    if path.endswith(('.pyc', '.pyo')):
+        path = path[:-1]
+
+    memo_key = (path, os.path.getmtime(path))
+    if memo_key not in _digests:
+        with open(path, 'rb') as f:
+            _digests[memo_key] = hashlib.sha1(f.read()).hexdigest()[:12]
+
+    return _digests[memo_key]
+
+
+def get_analyzer_identity(analyzer):
+    """
+    Identify an analyzer by its name and the source of its module, as it
+    was when the analyzer was first identified.
+    """
+    try:
+        return _identities[analyzer]
+    except KeyError:
+        module = sys.modules[analyzer.__module__]
+        identity = '{}@{}'.format(analyzer.__name__,
+                                  get_module_digest(module))
+        _identities[analyzer] = identity
+        return identity
+
+
+class AnalysisCache(object):
+    def __init__(self, store=None):
+        self.store = store if store is not None else {}
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return '<AnalysisCache hits=%d misses=%d hit_rate=%.1f%%>' % (
+            self.hits, self.misses, 100.0 * self.hit_rate)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return 1.0 * self.hits / total if total else 0.0
+
+    def get_key(self, analyzer, year, column):
+        identity = get_analyzer_identity(analyzer)
+        return '{}:{}:{}'.format(identity, year, column)
+
+    def has(self, analyzer, year, column):
+        return self.get_key(analyzer, year, column) in self.store
+
+    def get(self, analyzer, year, column):
+        """
+        Get a copy of a cached analysis, or `None` if it is missing.
+        """
+        key = self.get_key(analyzer, year, column)
+        try:
+            analysis = self.store[key]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        # Copy the analysis so that callers may modify their metadata
+        self.hits += 1
+        return dict(analysis, metadata=dict(analysis['metadata']))
+
+    def set(self, analyzer, year, column, analysis):
+        key = self.get_key(analyzer, year, column)
+        self.store[key] = dict(analysis, metadata=dict(analysis['metadata']))
+
+    def close(self):
+        if hasattr(self.store, 'close'):
+            self.store.close()
+
+
+def get_or_create_cache(persist=False):
+    if persist:
+        return AnalysisCache(shelve.open('cache.shelf'))
+
+    return AnalysisCache()
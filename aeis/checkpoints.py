@@ -0,0 +1,176 @@
+"""
+Checkpoints and dead letters, so that indexing runs can be resumed.
+
+A checkpoint records the settings of a run (like the index it loads)
+and, for each file, the offset of the row up to which its chunks were
+acknowledged, or that it's done. Chunks are acknowledged out of order by
+several sender threads, so a file's offset only advances over the chunks
+that were all acknowledged, and a resumed run starts each file over from
+its offset, re-sending at most a few chunks.
+
+Items that still fail after being retried are written as bulk lines to a
+dead-letter file, which can be sent again once fixed, and the chunk is
+acknowledged anyway. Their errors are kept in the checkpoint, so that a
+resumed run still knows about those of the run it resumes.
+
+    >>> checkpoint = Checkpoint.load('checkpoint.json')
+    >>> checkpoint.get_start('data/2012/cstud.dat')
+    12000
+"""
+from __future__ import absolute_import
+
+import json
+import logging
+import os
+import threading
+import timeit
+
+
+logger = logging.getLogger('aeis')
+timer = timeit.default_timer
+
+# How often to save a checkpoint, in seconds
+SAVE_INTERVAL = 5
+
+# How many failed documents to list per file in a report
+N_REPORTED_IDS = 10
+
+
+def get_key(task):
+    """
+    Get the key of a task, which is the path of its file.
+    """
+    return getattr(task, 'path', task)
+
+
+class Checkpoint(object):
+    def __init__(self, path='checkpoint.json', settings=None, files=None,
+                 dead_letters=None):
+        self.path = path
+        self.settings = settings or {}
+        self.files = files or {}
+        self.dead_letters = dead_letters or {}
+        self.skipped = []
+        self.resumed = {}
+        self.acks = {}
+        self.next_seqs = {}
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.last_save = timer()
+
+    def __repr__(self):
+        n_done = sum(1 for f in self.files.itervalues() if f.get('done'))
+        return '<Checkpoint %s: %d/%d files done>' % (
+            self.path, n_done, len(self.files))
+
+    @classmethod
+    def load(cls, path='checkpoint.json'):
+        with open(path) as f:
+            content = json.load(f)
+        return cls(path, settings=content['settings'],
+                   files=content['files'],
+                   dead_letters=content.get('dead_letters'))
+
+    def save(self):
+        with self.save_lock:
+            with self.lock:
+                content = json.dumps({'settings': self.settings,
+                                      'files': self.files,
+                                      'dead_letters': self.dead_letters},
+                                     indent=2, sort_keys=True)
+                self.last_save = timer()
+
+            # Replace the checkpoint atomically, so a crash can't corrupt it
+            with open(self.path + '.tmp', 'w') as f:
+                f.write(content)
+            os.rename(self.path + '.tmp', self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def get_start(self, key):
+        """
+        Get the row a file's load should start from, or None if it's
+        done. Both are reported.
+        """
+        progress = self.files.get(key, {})
+        if progress.get('done'):
+            self.skipped.append(key)
+            return None
+
+        row = progress.get('row', 0)
+        if row:
+            self.resumed[key] = row
+        return row
+
+    def ack(self, position):
+        """
+        Acknowledge the chunk at a (key, seq, row, last) position, and
+        advance its file over every chunk acknowledged in order.
+        """
+        key, seq, row, last = position
+        with self.lock:
+            acks = self.acks.setdefault(key, {})
+            acks[seq] = (row, last)
+            next_seq = self.next_seqs.get(key, 0)
+            while next_seq in acks:
+                row, last = acks.pop(next_seq)
+                next_seq += 1
+                self.files[key] = {'row': row, 'done': last}
+            self.next_seqs[key] = next_seq
+
+        if timer() - self.last_save > SAVE_INTERVAL:
+            self.save()
+
+
+class DeadLetters(object):
+    """
+    Write the bulk lines of items that failed to a file, and count their
+    errors by file, adding to `errors` if given, like those kept in a
+    checkpoint (along with its `lock`).
+    """
+    def __init__(self, path='dead_letters.ndjson', errors=None, lock=None):
+        self.path = path
+        self.file = open(path, 'ab')
+        self.errors = errors if errors is not None else {}
+        self.lock = lock or threading.Lock()
+
+    def __repr__(self):
+        return '<DeadLetters %s: %d items>' % (self.path, len(self))
+
+    def __len__(self):
+        return sum(e['count'] for e in self.errors.itervalues())
+
+    def write(self, key, failures):
+        """
+        Write the (item, lines) of a chunk's failed items.
+        """
+        with self.lock:
+            errors = self.errors.setdefault(
+                key, {'count': 0, 'reasons': {}, 'ids': []})
+            for item, lines in failures:
+                self.file.write(lines)
+                result = item.values()[0]
+                reason = str(result.get('error', 'unknown')).split('[')[0]
+                errors['count'] += 1
+                errors['reasons'][reason] = \
+                    errors['reasons'].get(reason, 0) + 1
+                if len(errors['ids']) < N_REPORTED_IDS:
+                    errors['ids'].append(result.get('_id'))
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def get_report(checkpoint, dead_letters=None):
+    """
+    Report the files a resumed run skipped or started partway through,
+    and the items it dead-lettered.
+    """
+    return {
+        'skipped_files': sorted(checkpoint.skipped),
+        'resumed_files': checkpoint.resumed,
+        'dead_letters': dead_letters.errors if dead_letters else {},
+    }
@@ -1,6 +1,9 @@
-from collections import Counter, defaultdict
+from array import array
 import sys
 
+import numpy
+from scipy import sparse
+
 from .files import get_files
 from .fields import get_columns
 
@@ -52,59 +55,92 @@ def alphabetize(metadata):
     print sorted(alphabet)
 
 
-def correlate_ngrams(columns, metadata, threshold=0.5):
-    column_count_by_ngram = defaultdict(int)
-    token_counts_by_ngram = {}
+def get_matrix(indices, indptr, ids):
+    """
+    Build a sparse matrix of counts from the CSR `indices` and `indptr` of
+    IDs, with its columns reordered so the vocabulary is sorted.
+    """
+    names = sorted(ids)
+    order = [ids[name] for name in names]
+    indices = numpy.frombuffer(indices, dtype=numpy.intc)
+    data = numpy.ones(len(indices), dtype=numpy.int64)
+    matrix = sparse.csr_matrix((data, indices, indptr),
+                               shape=(len(indptr) - 1, len(ids)))
+    matrix.sum_duplicates()
+    return names, matrix[:, order].tocsr()
+
+
+def encode(columns, metadata):
+    """
+    Count the n-grams of each column and the tokens of its descriptions
+    into sparse (columns x n-grams) and (columns x tokens) matrices.
+    """
+    ngram_ids = {}
+    token_ids = {}
+    ngram_indices = array('i')
+    token_indices = array('i')
+    ngram_indptr = [0]
+    token_indptr = [0]
     for column in columns:
-        meta = metadata.get(column, {})
         for ngram in iter_ngrams(column):
-            column_count_by_ngram[ngram] += 1
-            token_counts_by_ngram.setdefault(ngram, Counter())
-            for description in meta.get('descriptions', []):
-                tokens = tokenize(description)
-                token_counts_by_ngram[ngram].update(tokens)
-
-    correlations = {}
-    for ngram, counter in token_counts_by_ngram.iteritems():
-        for token, count in counter.most_common(3):
-            total = column_count_by_ngram[ngram]
-            correlations[(ngram, token)] = 1.0 * count / total
-
-    sorted_correlations = sorted(
-        correlations.items(),
-        key=lambda kv: (kv[0], -kv[1])
-    )
-    for (ngram, token), correlation in sorted_correlations:
-        if correlation < threshold:
-            continue
-        print ngram, token, correlation
+            ngram_indices.append(ngram_ids.setdefault(ngram, len(ngram_ids)))
 
-
-def correlate_tokens(columns, metadata, threshold=0.5):
-    token_count = defaultdict(int)
-    ngram_counts_by_token = {}
-    for column in columns:
         meta = metadata.get(column, {})
-        ngrams = ngramize(column)
         for description in meta.get('descriptions', []):
             for token in tokenize(description):
-                token_count[token] += 1
-                ngram_counts_by_token.setdefault(token, Counter())
-                ngram_counts_by_token[token].update(ngrams)
-
-    correlations = {}
-    for token, counter in ngram_counts_by_token.iteritems():
-        for ngram, count in counter.most_common(3):
-            total = token_count[token]
-            correlations[(token, ngram)] = 1.0 * count / total
-
-    sorted_correlations = sorted(
-        correlations.items(),
-        key=lambda kv: (kv[0], -kv[1])
-    )
-    for (token, ngram), correlation in sorted_correlations:
-        if correlation < threshold:
-            break
+                token_indices.append(
+                    token_ids.setdefault(token, len(token_ids)))
+
+        ngram_indptr.append(len(ngram_indices))
+        token_indptr.append(len(token_indices))
+
+    ngrams, ngram_matrix = get_matrix(ngram_indices, ngram_indptr, ngram_ids)
+    tokens, token_matrix = get_matrix(token_indices, token_indptr, token_ids)
+    return ngrams, ngram_matrix, tokens, token_matrix
+
+
+def iter_correlations(rows, row_names, columns, column_names, k=3,
+                      threshold=0.5, block_size=4096):
+    """
+    Correlate the features of two (columns x features) matrices, yielding
+    `(row feature, column feature, correlation)` for the top `k` column
+    features of each row feature, in sorted order.
+
+    The correlation is the number of co-occurrences over the number of
+    occurrences of the row feature. Co-occurrences are computed for a
+    block of row features at a time to bound memory.
+    """
+    totals = numpy.asarray(rows.sum(axis=0), dtype=numpy.float64).ravel()
+    rows = rows.T.tocsr()
+    for start in xrange(0, rows.shape[0], block_size):
+        block = rows[start:start + block_size].dot(columns).tocsr()
+        row_ids = numpy.repeat(numpy.arange(block.shape[0]),
+                               numpy.diff(block.indptr))
+        correlations = block.data / totals[start + row_ids]
+
+        # Rank the entries of each row by count, then by column feature
+        order = numpy.lexsort((block.indices, -block.data, row_ids))
+        ranks = numpy.arange(len(order)) - block.indptr[row_ids[order]]
+        keep = order[(ranks < k) & (correlations[order] >= threshold)]
+        keep = keep[numpy.lexsort((block.indices[keep], row_ids[keep]))]
+
+        for i in keep:
+            yield (row_names[start + row_ids[i]],
+                   column_names[block.indices[i]],
+                   float(correlations[i]))
+
+
+def correlate_ngrams(columns, metadata, threshold=0.5):
+    ngrams, ngram_matrix, tokens, token_matrix = encode(columns, metadata)
+    for ngram, token, correlation in iter_correlations(
+            ngram_matrix, ngrams, token_matrix, tokens, threshold=threshold):
+        print ngram, token, correlation
+
+
+def correlate_tokens(columns, metadata, threshold=0.5):
+    ngrams, ngram_matrix, tokens, token_matrix = encode(columns, metadata)
+    for token, ngram, correlation in iter_correlations(
+            token_matrix, tokens, ngram_matrix, ngrams, threshold=threshold):
         print token, ngram, correlation
 
 
@@ -0,0 +1,203 @@
+"""
+Cluster columns with similar descriptions across years, to find the
+columns of different years that measure the same thing.
+
+Descriptions are shingled into character n-grams and summarized by
+MinHash signatures. Signatures are split into bands, and only columns
+that share a band are compared, so clustering takes near-linear time
+instead of comparing every pair of columns.
+
+Usage:
+
+    $ python -m aeis.cluster data > crosswalk.csv
+    $ python -m aeis.cluster data --threshold 0.8 --bands 32 --rows 4
+
+The crosswalk has a row for each pair of similar columns from different
+years, with the Jaccard similarity of their shingles and a cluster ID
+shared by all columns linked by such pairs.
+"""
+from __future__ import absolute_import
+
+import logging
+import re
+import sys
+import zlib
+
+import numpy
+
+from .fields import get_columns
+from .files import get_files
+from .options import get_option
+
+
+logger = logging.getLogger('aeis')
+
+# A Mersenne prime for hashing shingles, small enough that products of
+# hashes and coefficients fit in 64 bits
+PRIME = (1 << 31) - 1
+
+
+def normalize(description):
+    """
+    Normalize a description for comparison across years.
+
+    >>> normalize('2012 Campus Enrollment:  Hispanic (Count)')
+    'campus enrollment hispanic count'
+    """
+    description = re.sub(r'\b(19|20)\d\d\b', ' ', description.lower())
+    return ' '.join(re.findall(r'[a-z0-9]+', description))
+
+
+def get_shingles(text, size=4):
+    """
+    Get the hashes of the character n-grams of `text`.
+    """
+    if len(text) <= size:
+        return set([zlib.crc32(text) % PRIME])
+    return set(zlib.crc32(text[i:i + size]) % PRIME
+               for i in xrange(len(text) - size + 1))
+
+
+class MinHasher(object):
+    def __init__(self, permutations=128, seed=0):
+        rng = numpy.random.RandomState(seed)
+        self.a = rng.randint(1, PRIME, size=permutations).astype(numpy.int64)
+        self.b = rng.randint(0, PRIME, size=permutations).astype(numpy.int64)
+
+    def get_signature(self, shingles):
+        hashes = numpy.fromiter(shingles, dtype=numpy.int64,
+                                count=len(shingles))
+        values = (numpy.outer(self.a, hashes) + self.b[:, None]) % PRIME
+        return values.min(axis=1)
+
+
+class DisjointSet(object):
+    def __init__(self):
+        self.parents = {}
+
+    def find(self, item):
+        parent = self.parents.setdefault(item, item)
+        if parent != item:
+            parent = self.parents[item] = self.find(parent)
+        return parent
+
+    def union(self, item, other):
+        self.parents[self.find(item)] = self.find(other)
+
+
+def get_candidates(signatures, bands, rows):
+    """
+    Get pairs of indexes of signatures that are equal in any band.
+    """
+    signatures = numpy.vstack(signatures)
+    weights = numpy.random.RandomState(0).randint(
+        1, PRIME, size=rows).astype(numpy.int64)
+    candidates = set()
+    for band in xrange(bands):
+        # Bucket signatures by a hash of their band, which may collide,
+        # but only adds candidates that are then compared
+        band_start = band * rows
+        keys = signatures[:, band_start:band_start + rows].dot(weights)
+        order = numpy.argsort(keys, kind='mergesort')
+        keys = keys[order]
+        starts = numpy.flatnonzero(numpy.r_[True, keys[1:] != keys[:-1]])
+        ends = numpy.r_[starts[1:], len(keys)]
+        shared = ends - starts > 1
+        for start, end in zip(starts[shared], ends[shared]):
+            bucket = sorted(order[start:end].tolist())
+            for j, first in enumerate(bucket):
+                for second in bucket[j + 1:]:
+                    candidates.add((first, second))
+
+    return candidates
+
+
+def jaccard(first, second):
+    return 1.0 * len(first & second) / len(first | second)
+
+
+def cluster(items, threshold=0.5, bands=32, rows=4, seed=0):
+    """
+    Cluster `(year, file, column, description)` items, and yield
+    `(cluster, item, other_item, similarity)` for each pair of items from
+    different years whose similarity is at least `threshold`.
+    """
+    # Columns with identical descriptions only need to be hashed once
+    items_by_text = {}
+    for item in items:
+        text = normalize(item[3])
+        if text:
+            items_by_text.setdefault(text, []).append(item)
+
+    texts = sorted(items_by_text)
+    shingles = [get_shingles(text) for text in texts]
+    hasher = MinHasher(permutations=bands * rows, seed=seed)
+    signatures = [hasher.get_signature(s) for s in shingles]
+    candidates = get_candidates(signatures, bands, rows)
+    logger.info('%d descriptions, %d candidate pairs', len(texts),
+                len(candidates))
+
+    pairs = []
+    for text in texts:
+        pairs.append((text, text, 1.0))
+    for first, second in candidates:
+        similarity = jaccard(shingles[first], shingles[second])
+        if similarity >= threshold:
+            pairs.append((texts[first], texts[second], similarity))
+
+    clusters = DisjointSet()
+    matches = []
+    for text, other_text, similarity in pairs:
+        for i, item in enumerate(items_by_text[text]):
+            other_items = items_by_text[other_text]
+            if other_text == text:
+                other_items = other_items[i + 1:]
+            for other_item in other_items:
+                if item[0] < other_item[0]:
+                    matches.append((item, other_item, similarity))
+                elif other_item[0] < item[0]:
+                    matches.append((other_item, item, similarity))
+                else:
+                    continue
+                clusters.union(item, other_item)
+
+    cluster_ids = {}
+    for item, other_item, similarity in sorted(
+            matches, key=lambda m: (clusters.find(m[0]), m[0], m[1])):
+        root = clusters.find(item)
+        cluster_id = cluster_ids.setdefault(root, len(cluster_ids) + 1)
+        yield cluster_id, item, other_item, similarity
+
+
+def get_items(root):
+    """
+    Get `(year, file, column, description)` for each described column.
+    """
+    for aeis_file in sorted(get_files(root), key=lambda f: f.path):
+        metadata = {}
+        for column in get_columns(aeis_file, metadata=metadata):
+            descriptions = metadata.get(column, {}).get('descriptions')
+            if descriptions:
+                yield (aeis_file.year, aeis_file.base_name, column,
+                       ' '.join(sorted(descriptions)))
+
+
+if __name__ == '__main__':
+    from csvkit import CSVKitWriter
+
+    logging.basicConfig()
+    logger.setLevel(logging.INFO)
+
+    root = sys.argv[1]
+    threshold = get_option('--threshold', default=0.5, type=float)
+    bands = get_option('--bands', default=32, type=int)
+    rows = get_option('--rows', default=4, type=int)
+
+    writer = CSVKitWriter(sys.stdout)
+    writer.writerow(('cluster', 'year', 'file', 'column', 'other_year',
+                     'other_file', 'other_column', 'similarity'))
+    for cluster_id, item, other_item, similarity in cluster(
+            list(get_items(root)), threshold=threshold, bands=bands,
+            rows=rows):
+        writer.writerow((cluster_id,) + item[:3] + other_item[:3] +
+                        ('%.3f' % similarity,))
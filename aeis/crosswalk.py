@@ -0,0 +1,136 @@
+"""
+A crosswalk from measures to the columns that hold them in each year.
+
+The same measure often has a different column name in different years
+and files. A measure is identified by the facets of its analysis, other
+than its `version` and `key`, and the crosswalk maps each measure to the
+(year, file, column) of every column that holds it.
+
+Usage:
+
+    $ python -m aeis.crosswalk build data
+    $ python -m aeis.crosswalk get field=enrollment level=campus \\
+        race=hispanic measure=count
+
+The crosswalk is stored in `crosswalk.shelf`.
+"""
+from __future__ import absolute_import
+
+import logging
+import shelve
+import sys
+
+from .cache import get_or_create_cache
+from .decompose import Decomposer
+from .files import get_files
+from .store import get_facets
+
+
+logger = logging.getLogger('aeis')
+
+# Facets that identify a column rather than its measure
+NON_MEASURE_FACETS = ('version',)
+
+
+def get_identity(analysis):
+    """
+    Get the identity of the measure of an analysis, or of a dict of
+    facets.
+
+    >>> get_identity({'key': 'CPETHISC', 'version': 2013,
+    ...               'level': 'campus', 'field': 'enrollment'})
+    'field=enrollment;level=campus'
+    """
+    facets = sorted((f, v) for f, v in get_facets(analysis)
+                    if f not in NON_MEASURE_FACETS)
+    return ';'.join(u'%s=%s' % facet for facet in facets).encode('utf-8')
+
+
+def build_crosswalk(root, decomposer=None):
+    """
+    Analyze every column of every file, and map the identities of their
+    measures to lists of (year, file, column).
+    """
+    decomposer = decomposer or Decomposer(root, analysis={})
+    crosswalk = {}
+    n_failures = 0
+    for aeis_file in sorted(get_files(root), key=lambda f: f.path):
+        for column in aeis_file.get_header():
+            column = str(column)
+            try:
+                analysis = decomposer.decompose(column, aeis_file=aeis_file)
+            except (RuntimeError, ValueError) as e:
+                logger.debug('%s/%s:%s: %s', aeis_file.year,
+                             aeis_file.base_name, column, e)
+                n_failures += 1
+                continue
+
+            identity = get_identity(analysis)
+            crosswalk.setdefault(identity, []).append(
+                (aeis_file.year, aeis_file.base_name, column))
+
+    if n_failures:
+        logger.warning('%d columns could not be analyzed', n_failures)
+
+    return crosswalk
+
+
+class Crosswalk(object):
+    """
+    A dict-like view of a stored crosswalk.
+    """
+    def __init__(self, path='crosswalk.shelf', flag='r'):
+        self.path = path
+        self.shelf = shelve.open(path, flag=flag)
+
+    def __repr__(self):
+        return '<Crosswalk %s of %d measures>' % (self.path, len(self.shelf))
+
+    def __getitem__(self, identity):
+        return self.shelf[identity]
+
+    def __contains__(self, identity):
+        return identity in self.shelf
+
+    def __iter__(self):
+        return iter(self.shelf)
+
+    def get(self, **facets):
+        """
+        Get the (year, file, column) of every column of a measure, like
+        `crosswalk.get(field='enrollment', level='campus', group='all')`.
+        """
+        return self.shelf.get(get_identity(facets), [])
+
+    def get_columns_by_year(self, **facets):
+        columns_by_year = {}
+        for year, base_name, column in self.get(**facets):
+            columns_by_year.setdefault(year, []).append((base_name, column))
+        return columns_by_year
+
+    def update(self, crosswalk):
+        for identity, columns in crosswalk.iteritems():
+            self.shelf[identity] = sorted(columns)
+
+    def close(self):
+        self.shelf.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig()
+    logger.setLevel(logging.INFO)
+
+    command = sys.argv[1]
+    if command == 'build':
+        root = sys.argv[2]
+        cache = get_or_create_cache(persist='--cache' in sys.argv)  # XXX
+        crosswalk = Crosswalk(flag='n')
+        crosswalk.update(build_crosswalk(
+            root, decomposer=Decomposer(root, analysis={}, cache=cache)))
+        cache.close()
+        print crosswalk
+        crosswalk.close()
+    elif command == 'get':
+        facets = dict(term.split('=', 1) for term in sys.argv[2:])
+        for year, base_name, column in Crosswalk().get(**facets):
+            print '%s/%s:%s' % (year, base_name, column)
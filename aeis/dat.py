@@ -5,9 +5,15 @@ from csvkit import CSVKitReader, CSVKitDictReader
 
 
 class DatParser(object):
-    def __init__(self, lyt_path=None, encoding='utf-8'):
+    """
+    Parse the records of a DAT file, with its layout if it has one. With
+    `columns`, records only have those columns, and the others are never
+    decoded.
+    """
+    def __init__(self, lyt_path=None, encoding='utf-8', columns=None):
         self.lyt_path = lyt_path
         self.encoding = encoding
+        self.columns = set(columns) if columns is not None else None
         self.layout = self._parse_layout()
 
     def _parse_layout(self):
@@ -52,6 +58,10 @@ class DatParser(object):
 
     def _parse_with_layout(self, dat_path, header_field):
         header_name = self.layout[0]['name']
+        fields = [(field[header_field], field['pos'] - 1)
+                  for field in self.layout
+                  if self.columns is None or
+                  field[header_field] in self.columns]
         with open(dat_path) as f:
             reader = CSVKitReader(f)
             for row in reader:
@@ -64,9 +74,7 @@ class DatParser(object):
 
                 # Build record with names from layout
                 record = {}
-                for field in self.layout:
-                    header = field[header_field]
-                    index = field['pos'] - 1
+                for header, index in fields:
                     try:
                         record[header] = row[index]
                     except IndexError:
@@ -78,4 +86,7 @@ class DatParser(object):
         with open(dat_path) as f:
             reader = CSVKitDictReader(f)
             for row in reader:
+                if self.columns is not None:
+                    row = dict((c, v) for c, v in row.iteritems()
+                               if c in self.columns)
                 yield row
@@ -0,0 +1,132 @@
+"""
+Decompose many columns at once into their analyses.
+
+Columns are read one per line, either bare (`CPETALLC`) or qualified by
+the file they come from (`2013/cstud.dat:CPETALLC`). Qualified columns,
+or all columns when `--file` is given, are analyzed with the analyzer for
+their file unless that analysis is cached. Bare columns are looked up in
+the stored analysis. Each analysis is written as a line of JSON, and
+columns that can't be decomposed are written with an "error".
+
+Usage:
+
+    $ python -m aeis.decompose columns.txt > analyses.json
+    $ python -m aeis.decompose --file data/2013/cstud.dat < columns.txt
+    $ python -m aeis.decompose --root data < qualified_columns.txt
+"""
+from __future__ import absolute_import
+
+import json
+import os
+import sys
+
+from .analysis import analyze_column, get_analysis, get_analyzer
+from .cache import get_or_create_cache
+from .files import AEISFile, get_files
+from .options import get_arguments, get_option
+from .store import to_json
+
+
+def parse_line(line):
+    """
+    Parse a column, and the year and file it's from if given.
+
+    >>> parse_line('2013/cstud.dat:CPETALLC')
+    (2013, 'cstud.dat', 'CPETALLC')
+    """
+    line = line.strip()
+    if ':' not in line:
+        return None, None, line
+
+    path, column = line.rsplit(':', 1)
+    year, base_name = path.split('/', 1)
+    return int(year), base_name.lower(), column
+
+
+def get_file(path):
+    _, extension = os.path.splitext(path)
+    return AEISFile(path=path, format=extension.strip('.').lower())
+
+
+class Decomposer(object):
+    def __init__(self, root='data', analysis=None, cache=None):
+        self.root = root
+        self.analysis = analysis if analysis is not None \
+            else get_analysis(root)
+        self.cache = cache if cache is not None else get_or_create_cache()
+        self.files = None
+
+    def get_file(self, year, base_name):
+        if self.files is None:
+            self.files = dict(((f.year, f.base_name), f)
+                              for f in get_files(self.root))
+        try:
+            return self.files[(year, base_name)]
+        except KeyError:
+            raise KeyError('No file %s/%s in %s' % (
+                year, base_name, self.root))
+
+    def decompose(self, column, aeis_file=None):
+        """
+        Decompose a column, analyzing it with the analyzer for the file
+        unless its analysis is cached. Without a file, the stored
+        analysis is returned.
+        """
+        if aeis_file is None:
+            try:
+                return self.analysis[column]
+            except KeyError:
+                raise KeyError('%s has not been analyzed, so its file is '
+                               'required to decompose it' % column)
+
+        analyzer = get_analyzer(aeis_file)
+        analysis = self.cache.get(analyzer, aeis_file.year, column)
+        if analysis is None:
+            analysis = analyze_column(aeis_file, column, analyzer,
+                                      metadata={})
+            self.cache.set(analyzer, aeis_file.year, column, analysis)
+
+        return analysis
+
+    def decompose_lines(self, lines, aeis_file=None):
+        """
+        Yield an analysis, or an error, for each line of columns.
+        """
+        for line in lines:
+            year, base_name, column = parse_line(line)
+            if not column:
+                continue
+
+            try:
+                line_file = aeis_file
+                if year is not None:
+                    line_file = self.get_file(year, base_name)
+                yield self.decompose(column, aeis_file=line_file)
+            except KeyError as e:
+                yield {'key': column, 'error': e.args[0]}
+            except (RuntimeError, ValueError) as e:
+                yield {'key': column, 'error': str(e)}
+
+
+def main(argv):
+    root = get_option('--root', default='data', argv=argv)
+    file_path = get_option('--file', argv=argv)
+    aeis_file = get_file(file_path) if file_path else None
+
+    # Read columns from the file given as the first argument, if any
+    arguments = get_arguments(options=('--root', '--file'), argv=argv)
+    lines = open(arguments[0]) if arguments else sys.stdin
+
+    cache = get_or_create_cache(persist='--cache' in argv)
+    decomposer = Decomposer(root, cache=cache)
+    n_errors = 0
+    for analysis in decomposer.decompose_lines(lines, aeis_file=aeis_file):
+        n_errors += 'error' in analysis
+        sys.stdout.write(json.dumps(analysis, default=to_json) + '\n')
+    cache.close()
+
+    return 1 if n_errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
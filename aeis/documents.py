@@ -0,0 +1,351 @@
+"""
+Build the Elasticsearch documents of the cells of AEIS files.
+
+Each cell is a document of its column's analysis (without metadata),
+with the key of its record, its value, and the column, file and version
+it comes from. All but the key and value are the same for every cell of
+a column, so each column's document is serialized once per file as a
+template, and each cell only splices its JSON-encoded key and value into
+it to make the lines of a bulk request.
+
+In the wide layout, each record of a file is instead a single document
+of its entity (like a campus), year and dataset, with a list of the
+measures of its cells. Each measure has the facets of its column's
+analysis, the column and its value, and is serialized from a template
+in the same way.
+
+`parse.py` writes the documents of cells alone, without their actions,
+either as JSON lines or, with a `PackedTemplate`, as a stream of msgpack
+maps spliced together the same way.
+
+For incremental loads, `iter_records` groups the documents of each
+record with their columns and types, and `get_delete_lines` deletes a
+document by the same ID.
+"""
+from __future__ import absolute_import
+
+import itertools
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from .keys import get_cdc_code
+
+
+encode_string = json.encoder.encode_basestring_ascii
+
+# Analysis keys that are left out of wide measures, because they belong
+# to the whole document
+NON_MEASURE_KEYS = ('key', 'metadata', 'version')
+
+WIDE_INDEX = 'aeis-wide'
+
+if msgpack is not None:
+    PACKED_KEY = msgpack.packb('key')
+    PACKED_VALUE = msgpack.packb('value')
+
+
+def encode_value(value):
+    if isinstance(value, basestring):
+        return encode_string(value)
+    return json.dumps(value)
+
+
+class DocumentTemplate(object):
+    """
+    The serialized bulk action and document of a column, but for the key
+    and value of each cell.
+    """
+    __slots__ = ('column', 'doc_type', 'action_head', 'action_tail',
+                 'source_head')
+
+    def __init__(self, analysis, aeis_file, index='aeis'):
+        source = get_source(analysis, aeis_file)
+        self.column = source['column']
+        self.doc_type = source['field']
+
+        # The ID is the key of the cell followed by the column and year
+        action = json.dumps({'index': {'_index': index,
+                                       '_type': source['field'],
+                                       '_id': ''}}, sort_keys=True)
+        action_head, action_tail = action.split('"_id": ""')
+        id_tail = encode_string(':%s:%d' % (self.column, aeis_file.year))
+        self.action_head = action_head + '"_id": "'
+        self.action_tail = id_tail[1:] + action_tail + '\n'
+
+        # Leave the document open for the key and value
+        self.source_head = json.dumps(source, sort_keys=True)[:-1] + \
+            ', "key": '
+
+    def render(self, encoded_key, value):
+        """
+        Render the bulk lines of a cell with the JSON-encoded key of its
+        record and its value.
+        """
+        return ''.join((
+            self.action_head, encoded_key[1:-1], self.action_tail,
+            self.source_head, encoded_key, ', "value": ', encode_value(value),
+            '}\n',
+        ))
+
+    def render_source(self, encoded_key, value):
+        """
+        Render the document of a cell alone, without its action or newline.
+        """
+        return ''.join((self.source_head, encoded_key, ', "value": ',
+                        encode_value(value), '}'))
+
+
+class PackedTemplate(object):
+    """
+    The msgpack-serialized document of a column, but for the key and value
+    of each cell. Requires `msgpack`.
+    """
+    __slots__ = ('column', 'head')
+
+    def __init__(self, analysis, aeis_file):
+        if msgpack is None:
+            raise RuntimeError('The msgpack format requires msgpack')
+
+        source = get_source(analysis, aeis_file)
+        self.column = source['column']
+
+        # A map of the static pairs, with room for the key and value
+        packer = msgpack.Packer()
+        parts = [packer.pack_map_header(len(source) + 2)]
+        for name in sorted(source):
+            parts.append(packer.pack(name))
+            parts.append(packer.pack(source[name]))
+        self.head = ''.join(parts)
+
+    def render(self, key, value):
+        return ''.join((self.head, PACKED_KEY, msgpack.packb(key),
+                        PACKED_VALUE, msgpack.packb(value)))
+
+
+def get_source(analysis, aeis_file):
+    """
+    Get the document of a column's cells, but for their key and value.
+    """
+    source = dict(analysis)
+    source.pop('metadata', None)
+    source.update(
+        column=source.pop('key'),
+        file=aeis_file.file_name,
+        version=aeis_file.year,
+    )
+    source.pop('value', None)
+    return source
+
+
+def get_templates(analysis, aeis_file, index='aeis', template_class=None):
+    """
+    Get a function that gets the template of a column, building it on
+    first use.
+    """
+    templates = {}
+
+    def get_template(column):
+        try:
+            return templates[column]
+        except KeyError:
+            if template_class is None:
+                template = DocumentTemplate(analysis[column], aeis_file,
+                                           index)
+            else:
+                template = template_class(analysis[column], aeis_file)
+            templates[column] = template
+            return template
+
+    return get_template
+
+
+def get_unselected_columns(aeis_file):
+    """
+    Get the columns a file only reads to identify its records, like its
+    key column when it wasn't selected, which have no documents.
+    """
+    selected_columns = getattr(aeis_file, 'selected_columns', None)
+    if selected_columns is None or aeis_file.columns is None:
+        return frozenset()
+    return frozenset(aeis_file.columns).difference(selected_columns)
+
+
+def iter_cells(record, unselected_columns):
+    """
+    Iterate over the (column, value) of a record's cells, but for its
+    unselected columns.
+    """
+    if not unselected_columns:
+        return record.iteritems()
+    return ((column, value) for column, value in record.iteritems()
+            if column not in unselected_columns)
+
+
+def iter_bulk_lines(analysis, aeis_file, index='aeis'):
+    """
+    Yield the bulk lines of the document of each cell of a file.
+    """
+    get_template = get_templates(analysis, aeis_file, index)
+    level = aeis_file.level
+    key_column = aeis_file.key_column
+    unselected_columns = get_unselected_columns(aeis_file)
+    for record in aeis_file:
+        encoded_key = encode_string(get_cdc_code(record, level, key_column))
+        for column, value in iter_cells(record, unselected_columns):
+            yield get_template(column).render(encoded_key, value)
+
+
+class MeasureTemplate(object):
+    """
+    The serialized measure of a column in a wide document, but for its
+    value.
+    """
+    __slots__ = ('head',)
+
+    def __init__(self, analysis):
+        measure = dict((k, v) for k, v in analysis.iteritems()
+                       if k not in NON_MEASURE_KEYS)
+        measure['column'] = analysis['key']
+        measure.pop('value', None)
+        self.head = json.dumps(measure, sort_keys=True)[:-1] + ', "value": '
+
+    def render(self, value):
+        return self.head + encode_value(value) + '}'
+
+
+class WideTemplate(object):
+    """
+    The serialized bulk action and wide document of a file's records, but
+    for the key and measures of each record.
+    """
+    __slots__ = ('analysis', 'measures', 'action_head', 'action_tail',
+                 'source_head')
+
+    def __init__(self, analysis, aeis_file, index=WIDE_INDEX):
+        self.analysis = analysis
+        self.measures = {}
+
+        id_tail = encode_string(':%s:%d' % (aeis_file.file_name,
+                                            aeis_file.year))[1:]
+        self.action_head = '{"index": {"_id": "'
+        self.action_tail = '%s, "_index": %s, "_type": %s}}\n' % (
+            id_tail, encode_string(index), encode_string(aeis_file.level))
+        self.source_head = '{"dataset": %s, "file": %s, "level": %s, ' \
+            '"version": %d, "key": ' % (
+                encode_string(aeis_file.root_name),
+                encode_string(aeis_file.file_name),
+                encode_string(aeis_file.level),
+                aeis_file.year)
+
+    def render(self, encoded_key, items):
+        """
+        Render the bulk lines of a record with its JSON-encoded key and
+        its (column, value) items.
+        """
+        measures = []
+        for column, value in items:
+            try:
+                template = self.measures[column]
+            except KeyError:
+                template = self.measures[column] = MeasureTemplate(
+                    self.analysis[column])
+            measures.append(template.render(value))
+
+        return ''.join((
+            self.action_head, encoded_key[1:-1], self.action_tail,
+            self.source_head, encoded_key, ', "measures": [',
+            ', '.join(measures), ']}\n',
+        ))
+
+
+def iter_wide_bulk_lines(analysis, aeis_file, index=WIDE_INDEX):
+    """
+    Yield the bulk lines of a wide document for each record of a file,
+    identified by its key, file and year.
+    """
+    template = WideTemplate(analysis, aeis_file, index)
+    level = aeis_file.level
+    key_column = aeis_file.key_column
+    unselected_columns = get_unselected_columns(aeis_file)
+    for record in aeis_file:
+        encoded_key = encode_string(get_cdc_code(record, level, key_column))
+        yield template.render(encoded_key,
+                              iter_cells(record, unselected_columns))
+
+
+def iter_records(analysis, aeis_file, index='aeis', wide=False):
+    """
+    Yield `(key, documents)` for each record of a file, where documents
+    is a list of the `(column, type, lines)` of its cells, sorted by
+    column. In the wide layout, it only has the record's document, with
+    no column.
+    """
+    level = aeis_file.level
+    key_column = aeis_file.key_column
+    unselected_columns = get_unselected_columns(aeis_file)
+    if wide:
+        template = WideTemplate(analysis, aeis_file, index)
+    else:
+        get_template = get_templates(analysis, aeis_file, index)
+
+    for record in aeis_file:
+        key = get_cdc_code(record, level, key_column)
+        encoded_key = encode_string(key)
+        if wide:
+            lines = template.render(encoded_key,
+                                    iter_cells(record, unselected_columns))
+            yield key, [(None, level, lines)]
+            continue
+
+        documents = []
+        for column in sorted(record):
+            if column in unselected_columns:
+                continue
+            cell_template = get_template(column)
+            documents.append((
+                column, cell_template.doc_type,
+                cell_template.render(encoded_key, record[column])))
+        yield key, documents
+
+
+def iter_row_lines(analysis, aeis_file, index='aeis', wide=False, start=0):
+    """
+    Yield the `(row, lines)` of each document of a file from its `start`
+    row on, where row is the offset of the document's record.
+    """
+    level = aeis_file.level
+    key_column = aeis_file.key_column
+    unselected_columns = get_unselected_columns(aeis_file)
+    if wide:
+        template = WideTemplate(analysis, aeis_file, index)
+    else:
+        get_template = get_templates(analysis, aeis_file, index)
+
+    records = itertools.islice(iter(aeis_file), start, None)
+    for row, record in enumerate(records, start):
+        encoded_key = encode_string(get_cdc_code(record, level, key_column))
+        if wide:
+            yield row, template.render(encoded_key,
+                                       iter_cells(record, unselected_columns))
+            continue
+
+        for column, value in iter_cells(record, unselected_columns):
+            yield row, get_template(column).render(encoded_key, value)
+
+
+def get_document_id(aeis_file, key, column=None):
+    """
+    Get the ID of the document of a cell, or of a record's wide document
+    if there's no column.
+    """
+    return '%s:%s:%d' % (key, column or aeis_file.file_name, aeis_file.year)
+
+
+def get_delete_lines(index, doc_type, doc_id):
+    return json.dumps({'delete': {'_index': index,
+                                  '_type': doc_type,
+                                  '_id': doc_id}}, sort_keys=True) + '\n'
@@ -0,0 +1,199 @@
+"""
+An inverted index from facet values to the columns that have them.
+
+Every column is assigned an integer ID, and each (facet, value) pair maps
+to a bitmap of IDs stored in a single (arbitrarily long) integer, so that
+AND/OR/NOT queries are plain bitwise operations.
+
+Usage:
+
+    $ python -m aeis.facet_index build analysis.db facets.idx
+    $ python -m aeis.facet_index query facets.idx \\
+        field=enrollment level=campus,district measure=count -race=all
+
+Query terms are ANDed together. A term matches any of its comma-separated
+values, which may be shell-style patterns (like `taks*`), and a term
+prefixed with "-" excludes its matches.
+"""
+from __future__ import absolute_import
+
+import fnmatch
+import json
+import re
+import sys
+import zlib
+
+from .store import AnalysisStore, get_facets
+
+
+TERM = re.compile(r'^(-?)([^=]+)=(.+)$')
+
+
+def parse_term(term):
+    """
+    Parse a term like `-dataset=staar*` into whether it excludes, its
+    facet, and a regex of its values.
+    """
+    match = TERM.match(term)
+    if match is None:
+        raise ValueError('Invalid term %r, expected one like '
+                         '"field=enrollment" or "-race=all,black"' % term)
+
+    exclude, facet, values = match.groups()
+    pattern = '|'.join(fnmatch.translate(v) for v in values.split(','))
+    return bool(exclude), facet, re.compile(pattern)
+
+
+class ColumnSet(object):
+    """
+    An immutable set of columns from a `FacetIndex`.
+    """
+    def __init__(self, index, bits=0):
+        self.index = index
+        self.bits = bits
+
+    def __repr__(self):
+        return '<ColumnSet of %d columns>' % len(self)
+
+    def __and__(self, other):
+        return ColumnSet(self.index, self.bits & other.bits)
+
+    def __or__(self, other):
+        return ColumnSet(self.index, self.bits | other.bits)
+
+    def __sub__(self, other):
+        return ColumnSet(self.index, self.bits & ~other.bits)
+
+    def __invert__(self):
+        return ColumnSet(self.index, self.index.universe & ~self.bits)
+
+    def __eq__(self, other):
+        return self.index is other.index and self.bits == other.bits
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __len__(self):
+        return bin(self.bits).count('1')
+
+    def __nonzero__(self):
+        return bool(self.bits)
+
+    def __contains__(self, column):
+        try:
+            column_id = self.index.ids[column]
+        except KeyError:
+            return False
+        return bool(self.bits >> column_id & 1)
+
+    def __iter__(self):
+        # Scan the binary digits from the lowest ID up
+        digits = bin(self.bits)[:1:-1]
+        column_id = digits.find('1')
+        while column_id != -1:
+            yield self.index.columns[column_id]
+            column_id = digits.find('1', column_id + 1)
+
+
+class FacetIndex(object):
+    def __init__(self, columns, postings):
+        self.columns = columns
+        self.ids = dict((c, i) for i, c in enumerate(columns))
+        self.postings = postings
+        self.universe = (1 << len(columns)) - 1
+
+    def __repr__(self):
+        return '<FacetIndex of %d columns, %d facet values>' % (
+            len(self.columns), len(self.postings))
+
+    @classmethod
+    def build(cls, analyses):
+        """
+        Build an index from (column, analysis) pairs.
+        """
+        columns = []
+        postings = {}
+        for column_id, (column, analysis) in enumerate(
+                sorted(analyses, key=lambda item: item[0])):
+            columns.append(column)
+            bit = 1 << column_id
+            for facet, value in get_facets(analysis):
+                key = (facet, value)
+                postings[key] = postings.get(key, 0) | bit
+
+        return cls(columns, postings)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = json.loads(zlib.decompress(f.read()))
+
+        postings = {}
+        for facet, values in data['postings'].iteritems():
+            for value, hex_bits in values.iteritems():
+                postings[(facet, value)] = int(hex_bits, 16)
+
+        return cls(data['columns'], postings)
+
+    def save(self, path):
+        postings = {}
+        for (facet, value), bits in self.postings.iteritems():
+            postings.setdefault(facet, {})[value] = '%x' % bits
+
+        data = {'columns': self.columns, 'postings': postings}
+        with open(path, 'wb') as f:
+            f.write(zlib.compress(json.dumps(data)))
+
+    def all(self):
+        return ColumnSet(self, self.universe)
+
+    def get(self, facet, value):
+        bits = self.postings.get((facet, unicode(value)), 0)
+        return ColumnSet(self, bits)
+
+    def get_any(self, facet, values):
+        column_set = ColumnSet(self)
+        for value in values:
+            column_set |= self.get(facet, value)
+        return column_set
+
+    def values(self, facet):
+        return sorted(v for f, v in self.postings if f == facet)
+
+    def query(self, terms):
+        """
+        Get the columns matching every term, like `field=enrollment`,
+        `race=black,hispanic`, `-group=all` or `field=taks*`.
+        """
+        column_set = self.all()
+        for term in terms:
+            exclude, facet, pattern = parse_term(term)
+            values = [v for v in self.values(facet) if pattern.match(v)]
+            matches = self.get_any(facet, values)
+            if exclude:
+                column_set -= matches
+            else:
+                column_set &= matches
+
+        return column_set
+
+
+def build_facet_index(store_path, index_path):
+    store = AnalysisStore(store_path)
+    index = FacetIndex.build(store.iteritems())
+    index.save(index_path)
+    return index
+
+
+if __name__ == '__main__':
+    command = sys.argv[1]
+    if command == 'build':
+        print build_facet_index(*sys.argv[2:4])
+    elif command == 'query':
+        index = FacetIndex.load(sys.argv[2])
+        try:
+            columns = index.query(sys.argv[3:])
+        except ValueError as e:
+            raise SystemExit(str(e))
+        for column in columns:
+            print column
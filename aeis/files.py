@@ -7,6 +7,7 @@ import sys
 from pyquery import PyQuery
 
 from .dat import DatParser
+from .keys import get_key_column
 
 
 def html_to_records(html):
@@ -26,6 +27,13 @@ class AEISFile(object):
         self.file_name, _ = os.path.splitext(self.base_name)
         self.format = format if format != 'txt' else 'dat'
 
+        # The columns to read, or all of them if None
+        self.columns = None
+
+        # The columns read to be indexed, or all of them if None, as
+        # opposed to the key column, which is always read
+        self.selected_columns = None
+
         # Parse year from path
         year_dir = os.path.dirname(path)
         year = int(os.path.basename(year_dir))
@@ -75,11 +83,35 @@ class AEISFile(object):
     def __repr__(self):
         return '<%d %s>' % (self.year, self.file_name)
 
+    @property
+    def key_column(self):
+        """
+        The column with the CDC code of each record, resolved once from
+        the file's header.
+        """
+        if not hasattr(self, '_key_column'):
+            self._key_column = get_key_column(self.get_header(), self.level)
+        return self._key_column
+
+    def get_header(self):
+        """
+        Get the names of the file's columns, in order if it has a layout.
+        """
+        if self.format == 'dat':
+            layout = self._get_dat_parser().layout
+            if layout:
+                return [field['name'] for field in layout]
+
+        try:
+            return list(next(iter(self)))
+        except StopIteration:
+            return []
+
     def __iter__(self):
         return getattr(self, '_get_%s_records' % self.format)()
 
     def _get_dat_parser(self):
-        return DatParser(self.layout_path)
+        return DatParser(self.layout_path, columns=self.columns)
 
     def _get_dat_records(self):
         return self._get_dat_parser().parse(self.path)
@@ -88,7 +120,13 @@ class AEISFile(object):
         # The XLS files provided by the TEA are actually HTML files
         # with the data in a TABLE element.
         content = open(self.path).read()
-        return html_to_records(content)
+        records = html_to_records(content)
+        if self.columns is None:
+            return records
+
+        columns = set(self.columns)
+        return (dict((c, v) for c, v in record.iteritems() if c in columns)
+                for record in records)
 
 
 def get_files(root):
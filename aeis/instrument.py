@@ -0,0 +1,131 @@
+"""
+Opt-in instrumentation of the analyzers.
+
+While enabled, the profiler counts how often each DSL transition of each
+analyzer is attempted, matched or failed, and times every regex match,
+every callable that parses a partial and every hand-written analyzer.
+
+    >>> profiler = instrument.enable()
+    >>> # ... analyze some columns ...
+    >>> profiler.write_report(sys.stdout, sort='seconds')
+    >>> profiler.write_flamegraph(open('analyzers.folded', 'w'))
+
+The flamegraph output uses the "folded stacks" format understood by
+flamegraph.pl and speedscope, weighted in microseconds.
+"""
+from __future__ import absolute_import
+
+import collections
+import timeit
+
+
+timer = timeit.default_timer
+
+# The active profiler, if any
+profiler = None
+
+
+class Profiler(object):
+    def __init__(self):
+        # (analyzer, transition) -> [attempted, matched, failed]
+        self.transitions = collections.defaultdict(lambda: [0, 0, 0])
+        # (analyzer, kind, name) -> [calls, seconds]
+        self.timings = collections.defaultdict(lambda: [0, 0.0])
+
+    def count(self, analyzer, transition, matched):
+        counts = self.transitions[(analyzer, transition)]
+        counts[0] += 1
+        counts[1 if matched else 2] += 1
+
+    def time(self, analyzer, kind, name, seconds):
+        timing = self.timings[(analyzer, kind, name)]
+        timing[0] += 1
+        timing[1] += seconds
+
+    def call(self, analyzer, function, *args):
+        """
+        Call a function that parses a partial, and time it.
+        """
+        start = timer()
+        try:
+            return function(*args)
+        finally:
+            self.time(analyzer, 'callable', function.__name__,
+                      timer() - start)
+
+    def timed(self, analyzer, iterable):
+        """
+        Time the work done by an iterable, but not by its consumer.
+        """
+        iterator = iter(iterable)
+        while True:
+            start = timer()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.time(analyzer, 'analyzer', analyzer, timer() - start)
+            yield item
+
+    def get_rows(self, sort='seconds'):
+        rows = {}
+        for (analyzer, transition), counts in self.transitions.iteritems():
+            row = rows.setdefault((analyzer, 'regex', transition), {
+                'analyzer': analyzer, 'kind': 'regex', 'name': transition,
+                'calls': 0, 'seconds': 0.0,
+            })
+            row.update(zip(('attempted', 'matched', 'failed'), counts))
+
+        for (analyzer, kind, name), (calls, seconds) in \
+                self.timings.iteritems():
+            row = rows.setdefault((analyzer, kind, name), {
+                'analyzer': analyzer, 'kind': kind, 'name': name,
+                'attempted': 0, 'matched': 0, 'failed': 0,
+            })
+            row.update(calls=calls, seconds=seconds)
+
+        reverse = sort not in ('analyzer', 'kind', 'name')
+        return sorted(rows.values(), key=lambda r: r[sort], reverse=reverse)
+
+    def write_report(self, stream, sort='seconds'):
+        line = '{:<20} {:<8} {:>9} {:>9} {:>9} {:>9} {:>10}  {}\n'
+        stream.write(line.format('analyzer', 'kind', 'attempted', 'matched',
+                                 'failed', 'calls', 'seconds', 'name'))
+        for row in self.get_rows(sort=sort):
+            stream.write(line.format(
+                row['analyzer'], row['kind'], row['attempted'],
+                row['matched'], row['failed'], row['calls'],
+                '%.6f' % row['seconds'], row['name']
+            ))
+
+    def write_flamegraph(self, stream):
+        # Analyzer timings include the regexes and callables within them,
+        # but each stack must be weighted by its own time alone.
+        child_seconds = collections.defaultdict(float)
+        for (analyzer, kind, name), (calls, seconds) in \
+                self.timings.iteritems():
+            if kind != 'analyzer':
+                child_seconds[analyzer] += seconds
+
+        for (analyzer, kind, name), (calls, seconds) in \
+                sorted(self.timings.iteritems()):
+            if kind == 'analyzer':
+                frames = [analyzer]
+                seconds = max(0.0, seconds - child_seconds[analyzer])
+            else:
+                frames = [analyzer, kind, name]
+            stack = ';'.join(f.replace(';', ':').replace(' ', '_')
+                             for f in frames)
+            stream.write('%s %d\n' % (stack, round(1e6 * seconds)))
+
+
+def enable():
+    global profiler
+    profiler = Profiler()
+    return profiler
+
+
+def disable():
+    global profiler
+    profiler = None
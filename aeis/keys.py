@@ -4,21 +4,44 @@ REGION = 'region'
 STATE = 'state'
 
 
-def get_cdc_code(record, level):
+def is_key_column(column, level):
+    lower_column = column.lower()
+    if 'cdc' in lower_column:
+        return True
+    elif level in (CAMPUS, DISTRICT, REGION) and lower_column == level:
+        return True
+    elif level == REGION and lower_column == 'region_n':
+        return True
+    return False
+
+
+def get_key_column(columns, level):
+    """
+    Find the column with the CDC code of each record at `level`, the
+    first in `columns` that looks like one. There is none for the state.
+    """
+    if level == STATE:
+        return None
+
+    for column in columns:
+        if is_key_column(column, level):
+            return column
+
+    raise ValueError('No %s key column in %r' % (level, list(columns)))
+
+
+def get_cdc_code(record, level, key_column=None):
+    """
+    Get the CDC code of a record, from its `key_column` if it has been
+    resolved already, like with `AEISFile.key_column`.
+    """
     if level == STATE:
         return 'state'
 
-    for key, value in record.items():
-        lower_key = key.lower()
-        if 'cdc' in lower_key:
-            return record[key]
-        elif level == CAMPUS == lower_key:
-            return record[key]
-        elif level == DISTRICT == lower_key:
-            return record[key]
-        elif level == REGION == lower_key:
-            return record[key]
-        elif level == REGION and lower_key == 'region_n':
-            return record[key]
-
-    raise ValueError(record)
+    if key_column is None:
+        try:
+            key_column = get_key_column(record, level)
+        except ValueError:
+            raise ValueError(record)
+
+    return record[key_column]
@@ -0,0 +1,265 @@
+"""
+A ledger of the content hashes of indexed documents, for incremental
+loads.
+
+For each index alias and file, the ledger keeps a hash of the file (with
+its layout and its columns' analyses) and, for each of its records, the
+hash of the source of each of its documents. When a file's hash is
+unchanged, it is skipped without being read. Otherwise, only documents
+that are new or whose hash changed are sent, and documents of columns or
+records that disappeared are deleted.
+
+Workers stage the new hashes of each file they load, and the staged
+hashes are only committed to the ledger once every document was indexed,
+so a failed load is simply loaded again:
+
+    >>> ledger = Ledger()
+    >>> ledger.clear_pending()
+    >>> # ... index iter_incremental_lines(Ledger(), 'aeis', ...) ...
+    >>> ledger.commit_pending()
+"""
+from __future__ import absolute_import
+
+import hashlib
+import json
+import sqlite3
+
+from .documents import get_delete_lines, get_document_id, iter_records
+from .files import AEISFile
+from .store import to_json
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    alias TEXT NOT NULL,
+    path TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    columns TEXT NOT NULL,
+    PRIMARY KEY (alias, path)
+);
+CREATE TABLE IF NOT EXISTS records (
+    alias TEXT NOT NULL,
+    path TEXT NOT NULL,
+    key TEXT NOT NULL,
+    hashes BLOB NOT NULL,
+    PRIMARY KEY (alias, path, key)
+);
+CREATE TABLE IF NOT EXISTS pending_files (
+    alias TEXT NOT NULL,
+    path TEXT NOT NULL,
+    hash TEXT,
+    columns TEXT NOT NULL,
+    PRIMARY KEY (alias, path)
+);
+CREATE TABLE IF NOT EXISTS pending_records (
+    alias TEXT NOT NULL,
+    path TEXT NOT NULL,
+    key TEXT NOT NULL,
+    hashes BLOB NOT NULL,
+    PRIMARY KEY (alias, path, key)
+);
+"""
+
+# Bytes of each document's hash
+HASH_SIZE = 8
+
+# Workers write to the ledger at the same time
+TIMEOUT = 60
+
+
+def get_hash(lines):
+    """
+    Hash the source of a document's bulk lines. Its action is left out,
+    since it only depends on the index it's loaded into and the document's
+    column and record.
+    """
+    return hashlib.md5(lines[lines.index('\n') + 1:]).digest()[:HASH_SIZE]
+
+
+def get_file_hash(analysis, aeis_file, index, wide=False):
+    """
+    Hash a file with its layout and the analyses of the columns it reads,
+    which together determine its documents.
+    """
+    digest = hashlib.sha1()
+    for path in (aeis_file.path, aeis_file.layout_path):
+        if not path:
+            continue
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), ''):
+                digest.update(block)
+
+    digest.update(json.dumps([index, wide]))
+    if aeis_file.selected_columns is not None:
+        digest.update(json.dumps(sorted(aeis_file.selected_columns)))
+    columns = aeis_file.columns
+    if columns is None:
+        columns = aeis_file.get_header()
+    for column in sorted(columns):
+        try:
+            column_analysis = analysis[column]
+        except KeyError:
+            column_analysis = None
+        digest.update(json.dumps([column, column_analysis], sort_keys=True,
+                                 default=to_json))
+
+    return digest.hexdigest()
+
+
+class Ledger(object):
+    def __init__(self, path='ledger.db'):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=TIMEOUT)
+        self.connection.text_factory = str
+        self.connection.executescript(SCHEMA)
+
+    def __repr__(self):
+        return '<Ledger %s>' % self.path
+
+    def get_file(self, alias, path):
+        """
+        Get the hash of a file and its [column, type] pairs, in the order
+        of its records' hashes.
+        """
+        row = self.connection.execute(
+            'SELECT hash, columns FROM files WHERE alias = ? AND path = ?',
+            (alias, path)
+        ).fetchone()
+        if row is None:
+            return None, []
+
+        return row[0], [tuple(c) for c in json.loads(row[1])]
+
+    def get_records(self, alias, path):
+        cursor = self.connection.execute(
+            'SELECT key, hashes FROM records WHERE alias = ? AND path = ?',
+            (alias, path))
+        return dict((key, str(hashes)) for key, hashes in cursor)
+
+    def get_paths(self, alias):
+        cursor = self.connection.execute(
+            'SELECT path FROM files WHERE alias = ? ORDER BY path', (alias,))
+        return [path for path, in cursor]
+
+    def stage(self, alias, path, file_hash, columns, records):
+        """
+        Stage the hashes of a loaded file, or its removal if `file_hash`
+        is None.
+        """
+        with self.connection:
+            self.connection.execute(
+                'DELETE FROM pending_records WHERE alias = ? AND path = ?',
+                (alias, path))
+            self.connection.execute(
+                'INSERT OR REPLACE INTO pending_files VALUES (?, ?, ?, ?)',
+                (alias, path, file_hash, json.dumps(columns)))
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO pending_records VALUES (?, ?, ?, ?)',
+                ((alias, path, key, sqlite3.Binary(hashes))
+                 for key, hashes in records))
+
+    def clear_pending(self):
+        with self.connection:
+            self.connection.execute('DELETE FROM pending_files')
+            self.connection.execute('DELETE FROM pending_records')
+
+    def commit_pending(self, reset_alias=None):
+        """
+        Replace the hashes of every staged file with the staged ones. With
+        `reset_alias`, the alias's other files are forgotten too, as when
+        its index was recreated.
+        """
+        with self.connection:
+            if reset_alias:
+                self.connection.execute(
+                    'DELETE FROM files WHERE alias = ?', (reset_alias,))
+                self.connection.execute(
+                    'DELETE FROM records WHERE alias = ?', (reset_alias,))
+
+            for table in ('files', 'records'):
+                self.connection.execute(
+                    'DELETE FROM %s WHERE EXISTS ('
+                    'SELECT 1 FROM pending_files p '
+                    'WHERE p.alias = %s.alias AND p.path = %s.path)'
+                    % (table, table, table))
+            self.connection.execute(
+                'INSERT INTO files SELECT * FROM pending_files '
+                'WHERE hash IS NOT NULL')
+            self.connection.execute(
+                'INSERT INTO records SELECT * FROM pending_records')
+            self.connection.execute('DELETE FROM pending_files')
+            self.connection.execute('DELETE FROM pending_records')
+
+    def close(self):
+        self.connection.close()
+
+
+def iter_incremental_lines(ledger, alias, analysis, aeis_file, index,
+                           wide=False, full=False):
+    """
+    Yield the bulk lines of a file's new and changed documents, and
+    delete the ones that disappeared, then stage its hashes. With `full`,
+    every document is considered new.
+    """
+    path = aeis_file.path
+    file_hash = get_file_hash(analysis, aeis_file, alias, wide)
+    if full:
+        old_hash, old_columns = None, []
+    else:
+        old_hash, old_columns = ledger.get_file(alias, path)
+    if file_hash == old_hash:
+        return
+
+    old_records = {} if full else ledger.get_records(alias, path)
+    old_offsets = dict((pair, i * HASH_SIZE)
+                       for i, pair in enumerate(old_columns))
+    columns = None
+    removed_columns = []
+    records = []
+    for key, documents in iter_records(analysis, aeis_file, index, wide):
+        if columns is None:
+            columns = [(column, doc_type)
+                       for column, doc_type, lines in documents]
+
+            # A column whose type changed leaves a document of its old type
+            column_set = set(columns)
+            removed_columns = [pair for pair in old_columns
+                               if pair not in column_set]
+
+        hashes = [get_hash(lines) for column, doc_type, lines in documents]
+        old_hashes = old_records.pop(key, None)
+        for (column, doc_type, lines), doc_hash in zip(documents, hashes):
+            offset = old_offsets.get((column, doc_type))
+            if old_hashes is None or offset is None or \
+                    old_hashes[offset:offset + HASH_SIZE] != doc_hash:
+                yield lines
+
+        if old_hashes is not None:
+            for column, doc_type in removed_columns:
+                yield get_delete_lines(
+                    index, doc_type, get_document_id(aeis_file, key, column))
+
+        records.append((key, ''.join(hashes)))
+
+    # Delete every document of the records that disappeared
+    for key in sorted(old_records):
+        for column, doc_type in old_columns:
+            yield get_delete_lines(
+                index, doc_type, get_document_id(aeis_file, key, column))
+
+    ledger.stage(alias, path, file_hash, columns or [], records)
+
+
+def iter_removed_lines(ledger, alias, path, index):
+    """
+    Delete every document of a file that no longer exists, and stage its
+    removal.
+    """
+    aeis_file = AEISFile(path)
+    old_hash, old_columns = ledger.get_file(alias, path)
+    for key in sorted(ledger.get_records(alias, path)):
+        for column, doc_type in old_columns:
+            yield get_delete_lines(
+                index, doc_type, get_document_id(aeis_file, key, column))
+
+    ledger.stage(alias, path, None, [], [])
@@ -0,0 +1,120 @@
+"""
+Load Elasticsearch indexes without disturbing the ones being read.
+
+Each load creates a new index, versioned by time, with settings for fast
+bulk loading: no refreshes and no replicas. Once it's loaded, its
+settings are restored, it's merged down to one segment, and the alias
+that readers use (like `aeis`) is moved to it atomically.
+
+    >>> name = create_index(indices, 'aeis', mappings=MAPPINGS)
+    >>> # ... index documents into `name` ...
+    >>> finish_index(indices, name)
+    >>> swap_alias(indices, 'aeis', name)
+"""
+from __future__ import absolute_import
+
+import logging
+import time
+
+
+logger = logging.getLogger('aeis')
+
+BULK_SETTINGS = {
+    'index': {
+        'refresh_interval': '-1',
+        'number_of_replicas': 0,
+    },
+}
+
+# Facets are matched exactly, so strings aren't analyzed
+MAPPINGS = {
+    '_default_': {
+        'dynamic_templates': [{
+            'strings': {
+                'match_mapping_type': 'string',
+                'mapping': {'type': 'string', 'index': 'not_analyzed'},
+            },
+        }],
+        'properties': {
+            'version': {'type': 'integer'},
+        },
+    },
+}
+
+# Wide documents are only looked up by entity, so their measures are
+# kept in the source without being indexed
+WIDE_MAPPINGS = {
+    '_default_': dict(
+        MAPPINGS['_default_'],
+        properties={
+            'version': {'type': 'integer'},
+            'measures': {'type': 'object', 'enabled': False},
+        },
+    ),
+}
+
+
+def get_version_name(alias):
+    return '%s-%s' % (alias, time.strftime('%Y%m%d%H%M%S'))
+
+
+def create_index(indices, alias, mappings=MAPPINGS):
+    """
+    Create a new version of the index behind `alias`, ready to load.
+    """
+    name = get_version_name(alias)
+    indices.create(index=name, body={
+        'settings': {
+            'index': dict(BULK_SETTINGS['index'], mapping={
+                'ignore_malformed': True,
+                'coerce': False,
+            }),
+        },
+        'mappings': mappings,
+    })
+    logger.info('created %s', name)
+    return name
+
+
+def finish_index(indices, name, replicas=1, refresh_interval='1s'):
+    """
+    Restore the settings of a loaded index, and merge its segments.
+    """
+    indices.put_settings(index=name, body={
+        'index': {
+            'refresh_interval': refresh_interval,
+            'number_of_replicas': replicas,
+        },
+    })
+    indices.refresh(index=name)
+    indices.optimize(index=name, max_num_segments=1)
+    logger.info('finished %s', name)
+
+
+def swap_alias(indices, alias, name):
+    """
+    Point `alias` at the index `name` instead of any other, atomically.
+
+    Returns the names of the indexes it pointed at before, which are
+    left in place.
+    """
+    # Earlier loads created a plain index named like the alias, which has
+    # to be deleted before the alias can take its place.
+    if indices.exists(index=alias) and \
+            not indices.exists_alias(name=alias):
+        logger.warning('deleting index %s to replace it with an alias',
+                       alias)
+        indices.delete(index=alias)
+
+    previous_names = []
+    if indices.exists_alias(name=alias):
+        previous_names = sorted(indices.get_alias(name=alias))
+
+    actions = [{'remove': {'index': n, 'alias': alias}}
+               for n in previous_names if n != name]
+    actions.append({'add': {'index': name, 'alias': alias}})
+    indices.update_aliases(body={'actions': actions})
+    logger.info('%s -> %s (was %s)', alias, name,
+                ', '.join(previous_names) or 'nothing')
+
+    return [n for n in previous_names if n != name]
@@ -0,0 +1,34 @@
+"""
+Minimal helpers for reading `--name value` options from the command line.
+"""
+import sys
+
+
+def get_option(name, default=None, type=str, argv=None):
+    """
+    Get the value following the flag `name`, or `default` if it's absent.
+    """
+    argv = argv if argv is not None else sys.argv
+    if name not in argv:
+        return default
+
+    try:
+        return type(argv[argv.index(name) + 1])
+    except IndexError:
+        raise ValueError('Option %s requires a value' % name)
+
+
+def get_arguments(options=(), argv=None):
+    """
+    Get the positional arguments after the script, skipping flags and the
+    values of the flags in `options`, which take one.
+    """
+    argv = argv if argv is not None else sys.argv
+    arguments = []
+    args = iter(argv[1:])
+    for arg in args:
+        if arg in options:
+            next(args, None)
+        elif not arg.startswith('--'):
+            arguments.append(arg)
+    return arguments
@@ -6,6 +6,8 @@ import sys
 
 from pyquery import PyQuery
 
+from . import keys
+
 CAMPUS = 'campus'
 DISTRICT = 'district'
 REGION = 'region'
@@ -27,17 +29,10 @@ class BaseRecordParser(object):
         if self.file.level in (STATE, REGION):
             return None
 
-        keys = record.keys()
-        for key in keys:
-            lower_key = key.lower()
-            if 'cdc' in lower_key:
-                return record[key]
-            elif self.file.level == CAMPUS == lower_key:
-                return record[key]
-            elif self.file.level == DISTRICT == lower_key:
-                return record[key]
-
-        raise ValueError(record)
+        # Legacy file objects don't resolve their key column
+        return keys.get_cdc_code(
+            record, self.file.level,
+            key_column=getattr(self.file, 'key_column', None))
 
     def clean_value(self, value, data_type=float):
         """
@@ -0,0 +1,145 @@
+"""
+A registry of analyzers by dataset (the root name of a file) and year.
+
+Analyzers are registered by dotted path, so they are only imported the
+first time a file needs them, and each (root name, year) is resolved
+once. After the analyzers are reloaded, `clear` forgets what was
+resolved, so paths are loaded again from the new modules, and a path to
+an analyzer that wasn't written yet is found once it is. Plugins can
+register their own analyzers, or override ours:
+
+    >>> from aeis import registry
+    >>> registry.register('fin', 'myplugin.analyzers:analyze_fin',
+    ...                   years=(2014, None))
+
+Modules listed in the AEIS_PLUGINS environment variable (comma-separated)
+are imported before the first lookup, so they can register analyzers for
+the command-line tools.
+"""
+from __future__ import absolute_import
+
+import importlib
+import os
+
+
+# (root name, (first year, last year), analyzer) with open-ended years
+# given as None
+ANALYZERS = (
+    ('cad', (None, None), 'aeis.analyzers:analyze_cad'),
+    ('comp', (None, None), 'aeis.analyzers:analyze_comp'),
+    ('fin', (None, None), 'aeis.analyzers:analyze_fin'),
+    ('fin', (2012, 2012), 'aeis.analyzers:analyze_fin_2012'),
+    ('othr', (None, None), 'aeis.analyzers:analyze_othr'),
+    ('ref', (None, None), 'aeis.analyzers:analyze_ref'),
+    ('staf', (None, None), 'aeis.analyzers:analyze_staf'),
+    ('stud', (None, None), 'aeis.analyzers:analyze_stud'),
+    ('taas', (None, None), 'aeis.analyzers:analyze_taas'),
+    ('tasa', (None, None), 'aeis.analyzers:analyze_taas'),
+    ('tasb', (None, None), 'aeis.analyzers:analyze_taas'),
+    ('tasc', (None, None), 'aeis.analyzers:analyze_taas'),
+    ('taks', (None, None), 'aeis.analyzers:analyze_taks'),
+    ('taks', (2013, 2013), 'aeis.analyzers:analyze_taks_2013'),
+    ('part1', (2013, 2013), 'aeis.analyzers:analyze_part1_2013'),
+    ('part2', (2013, 2013), 'aeis.analyzers:analyze_part1_2013'),
+    ('perf', (2013, 2013), 'aeis.analyzers:analyze_perf_2013'),
+    ('prof', (2013, 2013), 'aeis.analyzers:analyze_prof_2013'),
+    ('staar', (None, None), 'aeis.analyzers:analyze_staar'),
+)
+for number in range(1, 6):
+    ANALYZERS += (
+        ('taks%d' % number, (None, None), 'aeis.analyzers:analyze_taks'),
+        ('taks%d' % number, (2013, 2013),
+         'aeis.analyzers:analyze_taks_2013'),
+    )
+for number in range(1, 7):
+    ANALYZERS += (
+        ('staar%d' % number, (None, None), 'aeis.analyzers:analyze_staar'),
+    )
+
+
+def load(target):
+    """
+    Import an analyzer from a "module:attribute" path, or None if its
+    module doesn't have it (yet).
+    """
+    module_name, attribute = target.split(':', 1)
+    return getattr(importlib.import_module(module_name), attribute, None)
+
+
+class Registry(object):
+    def __init__(self, entries=(), plugins=()):
+        # root name -> [(first year, last year, order, analyzer or path)]
+        self.entries = {}
+        # (root name, year) -> analyzer, or None if there is none
+        self.resolved = {}
+        self.plugins = list(plugins)
+        for root_name, years, target in entries:
+            self.register(root_name, target, years=years)
+
+    def register(self, root_name, target, years=(None, None)):
+        """
+        Register an analyzer, or the "module:attribute" path of one, for
+        files of `root_name` within the inclusive range of `years`.
+
+        When several analyzers cover a year, the one with the narrowest
+        range wins, and then the one registered last.
+        """
+        first_year, last_year = years
+        entries = self.entries.setdefault(root_name.lower(), [])
+        entries.append((first_year, last_year, len(entries), target))
+        self.clear()
+
+    def clear(self):
+        """
+        Forget resolved analyzers, like after the analyzers are reloaded,
+        so that their paths are loaded again.
+        """
+        self.resolved.clear()
+
+    def get_span(self, first_year, last_year):
+        if first_year is None or last_year is None:
+            return float('inf')
+        return last_year - first_year
+
+    def resolve(self, root_name, year):
+        """
+        Get the analyzer for files of `root_name` from `year`, or None.
+        """
+        key = (root_name, year)
+        try:
+            return self.resolved[key]
+        except KeyError:
+            pass
+
+        while self.plugins:
+            importlib.import_module(self.plugins.pop(0))
+
+        best = None
+        for first_year, last_year, order, target in \
+                self.entries.get(root_name.lower(), ()):
+            if first_year is not None and year < first_year:
+                continue
+            elif last_year is not None and year > last_year:
+                continue
+
+            rank = (self.get_span(first_year, last_year), -order)
+            if best is None or rank < best[0]:
+                best = (rank, target)
+
+        analyzer = None
+        if best is not None:
+            target = best[1]
+            analyzer = load(target) if isinstance(target, basestring) \
+                else target
+
+        self.resolved[key] = analyzer
+        return analyzer
+
+
+registry = Registry(
+    ANALYZERS,
+    plugins=filter(None, os.environ.get('AEIS_PLUGINS', '').split(','))
+)
+register = registry.register
+resolve = registry.resolve
+clear = registry.clear
@@ -0,0 +1,131 @@
+"""
+Select the files and columns to index by their facets.
+
+A selection is a JSON object with query terms for files and for columns,
+like `selection.json`:
+
+    {
+        "files": ["year=1994,2012,2013", "-dataset=staar*"],
+        "columns": ["field=enrollment,staff,taks*", "measure=count,rate",
+                    "level=campus,district"]
+    }
+
+Terms are parsed as by `python -m aeis.facet_index query`: they are
+ANDed together, a term matches any of its comma-separated values, which
+may be shell-style patterns, and a term prefixed with "-" excludes its
+matches.
+
+Files are matched by their `dataset` (like `stud` or `staar1`), `year`,
+`level` and `file` name. Columns are matched by the facets of their
+analyses, once per column, and files only read the columns that match,
+along with their key column, which identifies their records but is only
+indexed if it matches too. Columns that weren't analyzed don't match any
+column terms.
+"""
+from __future__ import absolute_import
+
+import json
+
+from .facet_index import parse_term
+from .store import get_facets
+
+
+def match_terms(terms, facets):
+    """
+    Determine whether a dict of facet values matches every term.
+    """
+    for exclude, facet, pattern in terms:
+        value = facets.get(facet)
+        matches = value is not None and pattern.match(value) is not None
+        if matches == exclude:
+            return False
+    return True
+
+
+def get_file_facets(aeis_file):
+    return {
+        'dataset': aeis_file.root_name,
+        'year': unicode(aeis_file.year),
+        'level': aeis_file.level,
+        'file': aeis_file.file_name,
+    }
+
+
+class Selection(object):
+    def __init__(self, files=(), columns=()):
+        self.file_terms = [parse_term(t) for t in files]
+        self.column_terms = [parse_term(t) for t in columns]
+        self.selected_columns = {}
+
+    def __repr__(self):
+        return '<Selection of %d file terms and %d column terms>' % (
+            len(self.file_terms), len(self.column_terms))
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            content = json.load(f)
+        try:
+            return cls(files=content.get('files', ()),
+                       columns=content.get('columns', ()))
+        except ValueError as e:
+            raise ValueError('%s: %s' % (path, e))
+
+    def select_file(self, aeis_file):
+        return match_terms(self.file_terms, get_file_facets(aeis_file))
+
+    def select_column(self, column, analysis):
+        """
+        Determine whether a column is selected, by its analysis.
+        """
+        try:
+            return self.selected_columns[column]
+        except KeyError:
+            pass
+
+        try:
+            column_analysis = analysis[column]
+        except KeyError:
+            selected = False
+        else:
+            selected = match_terms(self.column_terms,
+                                   dict(get_facets(column_analysis)))
+
+        self.selected_columns[column] = selected
+        return selected
+
+    def get_selected_columns(self, aeis_file, analysis):
+        """
+        Get the selected columns of a file, or None for all of them.
+        """
+        if not self.column_terms:
+            return None
+
+        return [column for column in aeis_file.get_header()
+                if self.select_column(column, analysis)]
+
+    def get_columns(self, aeis_file, selected_columns):
+        """
+        Get the columns of a file to read, or None for all of them: the
+        selected ones, and its key column, which identifies its records.
+        """
+        if selected_columns is None:
+            return None
+
+        key_column = aeis_file.key_column
+        selected = set(selected_columns)
+        return [column for column in aeis_file.get_header()
+                if column == key_column or column in selected]
+
+    def apply(self, files, analysis):
+        """
+        Yield the selected files, set to only read their selected columns.
+        """
+        for aeis_file in files:
+            if not self.select_file(aeis_file):
+                continue
+
+            selected_columns = self.get_selected_columns(aeis_file, analysis)
+            aeis_file.selected_columns = selected_columns
+            aeis_file.columns = self.get_columns(aeis_file, selected_columns)
+            yield aeis_file
@@ -0,0 +1,247 @@
+"""
+Sinks for bulk requests, so that indexing can run without a cluster.
+
+A sink has the `bulk(body)` method of an Elasticsearch client, and
+returns a bulk response. `get_sink` makes one from a spec:
+
+* `es` sends to Elasticsearch at `ES_HOST`.
+* `file:aeis.ndjson` appends every request to a bulk file, which can be
+  loaded later with `curl -XPOST $ES_HOST/_bulk --data-binary @...`.
+* `local` (or `local:9201`) starts a stand-in for Elasticsearch in this
+  process that accepts `_bulk` over HTTP, and sends to it with a real
+  client. It keeps no documents unless asked to, and understands enough
+  index and alias requests for `--recreate`.
+
+    >>> sink = get_sink('local', threads=4)
+    >>> sink.bulk(body='{"index": {"_index": "aeis", ...}}\\n{...}\\n')
+"""
+from __future__ import absolute_import
+
+import BaseHTTPServer
+import json
+import logging
+import os
+import SocketServer
+import threading
+import urlparse
+
+from elasticsearch import Elasticsearch
+
+from .bulk import SOURCE_OP_TYPES
+
+
+logger = logging.getLogger('aeis')
+
+ES_HOST = os.environ.get('ES_HOST', 'localhost:9200')
+
+
+class FileSink(object):
+    """
+    Append bulk requests to a file of newline-delimited JSON.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'ab')
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return '<FileSink %s>' % self.path
+
+    def bulk(self, body):
+        with self.lock:
+            self.file.write(body)
+        # Nothing can fail to index, so there are no items to check
+        return {'took': 0, 'errors': False, 'items': []}
+
+    def close(self):
+        self.file.close()
+
+
+def iter_bulk_actions(body):
+    """
+    Yield the (op_type, meta, source) of each action of a bulk request,
+    where source is the unparsed line, or None for deletes.
+    """
+    lines = iter(body.splitlines())
+    for line in lines:
+        if not line.strip():
+            continue
+
+        (op_type, meta), = json.loads(line).items()
+        source = next(lines) if op_type in SOURCE_OP_TYPES else None
+        yield op_type, meta, source
+
+
+class LocalElasticsearch(SocketServer.ThreadingMixIn,
+                         BaseHTTPServer.HTTPServer):
+    """
+    An in-process stand-in for Elasticsearch that accepts bulk requests,
+    and keeps their documents if `keep` is true.
+    """
+    # Let requests finish before the process exits
+    daemon_threads = False
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, port=0, keep=False):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port),
+                                           LocalRequestHandler)
+        self.keep = keep
+        self.documents = {}
+        self.indices = set()
+        self.aliases = {}
+        self.lock = threading.Lock()
+        self.n_actions = 0
+        self.n_bytes = 0
+        self.thread = None
+
+    def __repr__(self):
+        return '<LocalElasticsearch %s: %d actions, %.1f MB>' % (
+            self.host, self.n_actions, self.n_bytes / 1e6)
+
+    @property
+    def host(self):
+        return '%s:%d' % self.server_address
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info('started %r', self)
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def bulk(self, body, default_index=None, default_type=None):
+        items = []
+        n_actions = 0
+        for op_type, meta, source in iter_bulk_actions(body):
+            n_actions += 1
+            index = meta.get('_index', default_index)
+            doc_type = meta.get('_type', default_type)
+            doc_key = (self.aliases.get(index, index), doc_type,
+                       meta.get('_id'))
+            status = 201 if source is not None else 200
+            if self.keep:
+                with self.lock:
+                    if source is not None:
+                        self.documents[doc_key] = source
+                    elif self.documents.pop(doc_key, None) is None:
+                        status = 404
+            items.append({op_type: {
+                '_index': index, '_type': doc_type, '_id': meta.get('_id'),
+                '_version': 1, 'status': status,
+            }})
+
+        with self.lock:
+            self.n_actions += n_actions
+            self.n_bytes += len(body)
+
+        return {'took': 0, 'errors': False, 'items': items}
+
+
+class LocalRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Connections are closed after each request, so that no handler is
+    # left waiting on one when the process exits. Responses are buffered,
+    # so that they're sent in one packet.
+    wbufsize = -1
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def respond(self, status, body=None):
+        content = json.dumps(body) if body is not None else ''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(content)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else ''
+
+    def get_parts(self):
+        path = urlparse.urlparse(self.path).path
+        return [part for part in path.split('/') if part]
+
+    def do_HEAD(self):
+        server = self.server
+        parts = self.get_parts()
+        if not parts:
+            exists = True
+        elif parts[0] == '_alias':
+            exists = parts[1] in server.aliases
+        else:
+            exists = parts[0] in server.indices or parts[0] in server.aliases
+        self.respond(200 if exists else 404)
+
+    def do_GET(self):
+        server = self.server
+        parts = self.get_parts()
+        if not parts:
+            self.respond(200, {'status': 200, 'tagline': 'You Know, for '
+                               'Search', 'version': {'number': '1.2.0'}})
+        elif parts[0] == '_alias' and parts[1] in server.aliases:
+            alias = parts[1]
+            index = server.aliases[alias]
+            self.respond(200, {index: {'aliases': {alias: {}}}})
+        else:
+            self.respond(404, {'error': 'IndexMissingException',
+                               'status': 404})
+
+    def do_POST(self):
+        server = self.server
+        body = self.read_body()
+        parts = self.get_parts()
+        if parts and parts[-1] == '_bulk':
+            defaults = parts[:-1] + [None, None]
+            self.respond(200, server.bulk(body, *defaults[:2]))
+        elif parts == ['_aliases']:
+            with server.lock:
+                for action in json.loads(body)['actions']:
+                    (op, alias_action), = action.items()
+                    alias = alias_action['alias']
+                    if op == 'add':
+                        server.aliases[alias] = alias_action['index']
+                    elif server.aliases.get(alias) == alias_action['index']:
+                        del server.aliases[alias]
+            self.respond(200, {'acknowledged': True})
+        else:
+            # Refreshes, optimizes and the like have nothing to do
+            self.respond(200, {'acknowledged': True})
+
+    def do_PUT(self):
+        server = self.server
+        self.read_body()
+        parts = self.get_parts()
+        if len(parts) == 1:
+            with server.lock:
+                server.indices.add(parts[0])
+        self.respond(200, {'acknowledged': True})
+
+    def do_DELETE(self):
+        server = self.server
+        parts = self.get_parts()
+        if len(parts) == 1:
+            with server.lock:
+                server.indices.discard(parts[0])
+        self.respond(200, {'acknowledged': True})
+
+
+def get_sink(spec='es', threads=4):
+    """
+    Get the sink of a spec like `es`, `file:aeis.ndjson` or `local:9201`.
+    """
+    kind, _, argument = spec.partition(':')
+    if kind == 'es':
+        return Elasticsearch(argument or ES_HOST, maxsize=threads)
+    elif kind == 'file':
+        return FileSink(argument or 'aeis.ndjson')
+    elif kind == 'local':
+        server = LocalElasticsearch(port=int(argument or 0)).start()
+        return Elasticsearch(server.host, maxsize=threads)
+    raise ValueError('Unknown sink %r' % spec)
@@ -0,0 +1,123 @@
+"""
+Sort (key, line) pairs by key with bounded memory.
+
+Pairs are buffered until they take about `max_buffered_bytes`, then
+sorted and spilled to a temporary run file. The runs are then merged
+into one sorted stream, with at most `max_runs` of them open at once: if
+there are more, consecutive runs are first merged into fewer, longer
+ones, in as many passes as needed. Sorting is stable, so the lines of a
+key keep their order.
+
+    >>> for key, lines in iter_groups(iter_sorted(pairs)):
+    ...     write(key, lines)
+
+Keys can't have tabs or newlines, but lines may be any bytes, like
+msgpack records.
+"""
+from __future__ import absolute_import
+
+import heapq
+import itertools
+import logging
+import operator
+import os
+import shutil
+import tempfile
+
+
+logger = logging.getLogger('aeis')
+
+MAX_BUFFERED_BYTES = 256 * 1024 * 1024
+MAX_RUNS = 64
+
+# The approximate memory taken by a buffered pair, beyond its strings
+PAIR_OVERHEAD = 120
+
+get_key = operator.itemgetter(0)
+
+
+def write_run(pairs, directory):
+    """
+    Write sorted pairs to a new run file, and return its path.
+    """
+    descriptor, path = tempfile.mkstemp(dir=directory, prefix='run-')
+    with os.fdopen(descriptor, 'wb') as f:
+        for key, line in pairs:
+            # Prefix each line with its size, since it may have newlines
+            f.write('%s\t%d\n' % (key, len(line)))
+            f.write(line)
+    return path
+
+
+def iter_run(path, run_index):
+    with open(path, 'rb') as f:
+        for header in iter(f.readline, ''):
+            key, size = header[:-1].split('\t')
+            yield key, run_index, f.read(int(size))
+
+
+def merge_runs(paths):
+    """
+    Merge sorted runs into one stream of pairs. Ties go to the earliest
+    run, so that merging is stable.
+    """
+    runs = [iter_run(path, i) for i, path in enumerate(paths)]
+    for key, run_index, line in heapq.merge(*runs):
+        yield key, line
+
+
+def iter_sorted(pairs, max_buffered_bytes=MAX_BUFFERED_BYTES,
+                max_runs=MAX_RUNS, directory=None):
+    """
+    Yield (key, line) pairs sorted by key, spilling them to runs in a
+    temporary directory (inside `directory`, if given) as needed.
+    """
+    directory = tempfile.mkdtemp(prefix='aeis-sort-', dir=directory)
+    try:
+        runs = []
+        buffer = []
+        buffered_bytes = 0
+        for key, line in pairs:
+            buffer.append((key, line))
+            buffered_bytes += len(key) + len(line) + PAIR_OVERHEAD
+            if buffered_bytes < max_buffered_bytes:
+                continue
+
+            buffer.sort(key=get_key)
+            runs.append(write_run(buffer, directory))
+            buffer = []
+            buffered_bytes = 0
+
+        buffer.sort(key=get_key)
+        if not runs:
+            for pair in buffer:
+                yield pair
+            return
+
+        runs.append(write_run(buffer, directory))
+        del buffer
+
+        # Merge consecutive runs until few enough can be opened at once
+        while len(runs) > max_runs:
+            logger.info('merging %d runs', len(runs))
+            merged_runs = []
+            for i in range(0, len(runs), max_runs):
+                batch = runs[i:i + max_runs]
+                merged_runs.append(write_run(merge_runs(batch), directory))
+                for run in batch:
+                    os.remove(run)
+            runs = merged_runs
+
+        logger.info('merging %d runs', len(runs))
+        for pair in merge_runs(runs):
+            yield pair
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def iter_groups(sorted_pairs):
+    """
+    Yield (key, lines) for each key of sorted pairs, with all its lines.
+    """
+    for key, pairs in itertools.groupby(sorted_pairs, key=get_key):
+        yield key, [line for _, line in pairs]
@@ -0,0 +1,184 @@
+"""
+Store column analyses in SQLite.
+
+Each analysis is stored as JSON under its column name, and its scalar
+facets (like `field`, `level` or `race`) are indexed so that columns can
+be queried by facet without loading every analysis.
+
+Usage:
+
+    $ python -m aeis.store migrate analysis.shelf analysis.db
+    $ python -m aeis.store query analysis.db race=hispanic measure=rate
+"""
+from __future__ import absolute_import
+
+import glob
+import json
+import shelve
+import sqlite3
+import sys
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    key TEXT PRIMARY KEY,
+    analysis TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS facets (
+    key TEXT NOT NULL,
+    facet TEXT NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS facets_by_value ON facets (facet, value, key);
+CREATE INDEX IF NOT EXISTS facets_by_key ON facets (key);
+"""
+
+# Analysis keys that are not facets of the column
+NON_FACETS = ('key', 'metadata')
+
+
+def to_json(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError('%r is not JSON serializable' % value)
+
+
+def get_facets(analysis):
+    """
+    Yield (facet, value) pairs for the scalar facets of an analysis.
+    """
+    for facet, value in analysis.iteritems():
+        if facet in NON_FACETS:
+            continue
+        elif isinstance(value, (basestring, int, long, float)):
+            yield facet, unicode(value)
+
+
+class AnalysisStore(object):
+    """
+    A dict-like store of column analyses backed by SQLite.
+
+    Analyses are loaded lazily, one key at a time.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def __repr__(self):
+        return '<AnalysisStore %s>' % self.path
+
+    def __getitem__(self, key):
+        row = self.connection.execute(
+            'SELECT analysis FROM analyses WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+
+        return json.loads(row[0])
+
+    def __setitem__(self, key, analysis):
+        self.update([(key, analysis)])
+
+    def __contains__(self, key):
+        return self.connection.execute(
+            'SELECT 1 FROM analyses WHERE key = ?', (key,)
+        ).fetchone() is not None
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM analyses'
+        ).fetchone()[0]
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def iterkeys(self):
+        cursor = self.connection.execute(
+            'SELECT key FROM analyses ORDER BY key')
+        for key, in cursor:
+            yield key
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def iteritems(self):
+        cursor = self.connection.execute(
+            'SELECT key, analysis FROM analyses ORDER BY key')
+        for key, analysis in cursor:
+            yield key, json.loads(analysis)
+
+    def update(self, items):
+        """
+        Insert or replace many analyses in a single transaction.
+        """
+        with self.connection:
+            for key, analysis in items:
+                content = json.dumps(analysis, default=to_json)
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO analyses VALUES (?, ?)',
+                    (key, content)
+                )
+                self.connection.execute(
+                    'DELETE FROM facets WHERE key = ?', (key,))
+                self.connection.executemany(
+                    'INSERT INTO facets VALUES (?, ?, ?)',
+                    ((key, f, v) for f, v in get_facets(analysis))
+                )
+
+    def filter(self, **facets):
+        """
+        Yield the keys of columns matching every given facet value.
+
+        >>> list(store.filter(race='hispanic', measure='rate'))
+        """
+        if not facets:
+            return self.iterkeys()
+
+        query = ' INTERSECT '.join(
+            ['SELECT key FROM facets WHERE facet = ? AND value = ?'] *
+            len(facets)
+        )
+        params = []
+        for facet, value in sorted(facets.items()):
+            params.extend((facet, unicode(value)))
+
+        cursor = self.connection.execute(query + ' ORDER BY key', params)
+        return (key for key, in cursor)
+
+    def close(self):
+        self.connection.close()
+
+
+def migrate_shelf(shelf_path, store):
+    """
+    Copy every analysis from a shelf into the store.
+    """
+    shelf = shelve.open(shelf_path, flag='r')
+    try:
+        store.update(shelf.iteritems())
+    finally:
+        shelf.close()
+
+
+def shelf_exists(shelf_path):
+    # Depending on the dbm backend, a shelf may span several files
+    return bool(glob.glob(shelf_path + '*'))
+
+
+if __name__ == '__main__':
+    command = sys.argv[1]
+    if command == 'migrate':
+        shelf_path, store_path = sys.argv[2:4]
+        migrate_shelf(shelf_path, AnalysisStore(store_path))
+    elif command == 'query':
+        store = AnalysisStore(sys.argv[2])
+        facets = dict(arg.split('=', 1) for arg in sys.argv[3:])
+        for key in store.filter(**facets):
+            print key
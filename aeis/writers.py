@@ -0,0 +1,113 @@
+"""
+Write lines to a file per key, like `data/target/<key>.json.txt`.
+
+Lines are buffered per key and written in batches, through a pool of at
+most `max_open` file handles, closing the least recently used one when
+the pool is full. In the `replace` mode, each key's file is written to a
+temporary file next to it, which replaces it atomically on `close`, so
+every file is written fresh and exactly once per run. In the `append`
+mode, lines are appended to existing files.
+
+    >>> writer = PooledWriter('data/target', suffix='.json.txt')
+    >>> writer.write('057905', '{"key": "057905", ...}\\n')
+    >>> writer.close()
+"""
+from __future__ import absolute_import
+
+import collections
+import os
+
+
+MAX_OPEN = 256
+
+# How many bytes to buffer in all, before writing every buffer
+MAX_BUFFERED_BYTES = 64 * 1024 * 1024
+
+
+class PooledWriter(object):
+    def __init__(self, directory, suffix='', mode='replace',
+                 max_open=MAX_OPEN, max_buffered_bytes=MAX_BUFFERED_BYTES):
+        if mode not in ('replace', 'append'):
+            raise ValueError('Unknown mode %r' % mode)
+
+        self.directory = directory
+        self.suffix = suffix
+        self.mode = mode
+        self.max_open = max_open
+        self.max_buffered_bytes = max_buffered_bytes
+        self.buffers = {}
+        self.buffered_bytes = 0
+        self.handles = collections.OrderedDict()
+        self.started = set()
+        self.n_opens = 0
+
+    def __repr__(self):
+        return '<PooledWriter %s: %d files, %d opens>' % (
+            self.directory, len(self.started), self.n_opens)
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get_handle(self, key):
+        """
+        Get the open file of a key, opening it (and closing the least
+        recently used one) if needed.
+        """
+        try:
+            handle = self.handles.pop(key)
+        except KeyError:
+            if len(self.handles) >= self.max_open:
+                _, lru_handle = self.handles.popitem(last=False)
+                lru_handle.close()
+
+            path = self.get_path(key)
+            if self.mode == 'replace':
+                path += '.tmp'
+                handle = open(path, 'a' if key in self.started else 'w')
+            else:
+                handle = open(path, 'a')
+            self.started.add(key)
+            self.n_opens += 1
+
+        self.handles[key] = handle
+        return handle
+
+    def write(self, key, line):
+        try:
+            self.buffers[key].append(line)
+        except KeyError:
+            self.buffers[key] = [line]
+
+        self.buffered_bytes += len(line)
+        if self.buffered_bytes >= self.max_buffered_bytes:
+            self.flush()
+
+    def write_all(self, key, lines):
+        """
+        Write every line of a key at once, like a group of sorted lines.
+        """
+        self.flush_key(key)
+        self.get_handle(key).write(''.join(lines))
+
+    def flush_key(self, key):
+        lines = self.buffers.pop(key, None)
+        if lines:
+            self.get_handle(key).write(''.join(lines))
+            self.buffered_bytes -= sum(len(line) for line in lines)
+
+    def flush(self):
+        # Write keys in order, so that files are reused while open
+        for key in sorted(self.buffers):
+            self.flush_key(key)
+        self.buffered_bytes = 0
+
+    def close(self):
+        self.flush()
+        for handle in self.handles.itervalues():
+            handle.close()
+        self.handles.clear()
+
+        if self.mode == 'replace':
+            for key in self.started:
+                path = self.get_path(key)
+                os.rename(path + '.tmp', path)
@@ -1,15 +1,21 @@
+import collections
 import json
 import logging
+import multiprocessing
 import pprint
 import sys
 import time
 import traceback
 
 from aeis.analyzers import get_or_create_metadata
-from aeis.analyzers import get_or_create_analysis
+from aeis.analysis import get_or_create_analysis
+from aeis.analysis import get_analysis
+from aeis.analysis import analyze_column, get_analyzer, reload_analyzers
+from aeis.cache import get_or_create_cache
 from aeis.fields import get_columns
 from aeis.files import get_files
-from aeis import analyzers
+from aeis.options import get_option
+from aeis import instrument
 
 
 logging.basicConfig()
@@ -28,23 +34,6 @@ def sleep_or_raise():
         time.sleep(3)
 
 
-def get_analyzer(aeis_file):
-    """
-    Get an appropriate analyzer for the file.
-    """
-    analyzer_name = 'analyze_%s' % aeis_file.root_name
-    analyzer_name_by_year = '%s_%s' % (analyzer_name, aeis_file.year)
-    analyzer = getattr(analyzers, analyzer_name, None)
-    analyzer = getattr(analyzers, analyzer_name_by_year, analyzer)
-    if not analyzer:
-        raise RuntimeError(
-            'You must implement an analyzer named "%s" to parse "%s"' % (
-                analyzer_name, aeis_file
-            ))
-
-    return analyzer
-
-
 def get_analyzer_in_loop(aeis_file):
     while True:
         try:
@@ -55,65 +44,14 @@ def get_analyzer_in_loop(aeis_file):
 
             try:
                 logger.info('reloading analyzers...')
-                globals()['analyzers'] = reload(analyzers)
+                reload_analyzers()
                 continue
             except SyntaxError as e:
                 traceback.print_exc()
                 continue
 
 
-def analyze_column(column, analyzer, metadata):
-    column_metadata = metadata.get(column, {})
-    column_metadata['decomposition'] = []
-    pretty_metadata = pprint.pformat(column_metadata)
-    analysis = {'metadata': column_metadata}
-
-    position = 0
-    remainder = column
-    for partial, data in analyzer(aeis_file, remainder):
-        logger.debug('partial: %r', repr(partial))
-        logger.debug('data: %r', repr(data))
-        try:
-            analysis.update(data)
-        except ValueError:
-            message = 'Analyzer %r yielded invalid data:\n%s' % (
-                analyzer.func_name,
-                pprint.pformat(data)
-            )
-            raise ValueError(message)
-
-        # Record decomposition
-        column_metadata['decomposition'].append((partial, data))
-
-        # Determine continuation from the partial value
-        if partial == remainder:
-            remainder = None
-            break
-        elif not remainder.startswith(partial):
-            message = (
-                'Invalid partial %r for remainder %r of %r' +
-                ' in position %d'
-            )
-            message %= (partial, remainder, column, position)
-            message += '\nMetadata: %r' % pretty_metadata
-            raise ValueError(message)
-
-        # Remove partial data from remainder
-        remainder = remainder.replace(partial, '', 1)
-        position += len(partial)
-
-    # If there is a remainder after the generator stops, raise an
-    # exception because we didn't parse all metadata from the field.
-    if remainder:
-        message = 'Could not parse remainder %r of %r in position %d'
-        message %= (remainder, column, position)
-        message += '\nMetadata: %r' % pretty_metadata
-        raise ValueError(message)
-
-    return analysis
-
-
-def analyze_column_in_loop(column, analyzer, metadata):
+def analyze_column_in_loop(aeis_file, column, analyzer, metadata):
     """
     Reload the current analyzer until it produces a usable analysis.
     """
@@ -125,7 +63,8 @@ def analyze_column_in_loop(column, analyzer, metadata):
                 aeis_file.base_name,
                 column
             ))
-            analysis = analyze_column(column, analyzer, metadata=metadata)
+            analysis = analyze_column(aeis_file, column, analyzer,
+                                      metadata=metadata)
             return analysis, analyzer
         except Exception as e:
             traceback.print_exc()
@@ -133,7 +72,7 @@ def analyze_column_in_loop(column, analyzer, metadata):
 
             try:
                 logger.info('reloading analyzers...')
-                globals()['analyzers'] = reload(analyzers)
+                reload_analyzers()
                 analyzer = get_analyzer(aeis_file)
                 continue
             except SyntaxError as e:
@@ -141,15 +80,181 @@ def analyze_column_in_loop(column, analyzer, metadata):
                 continue
 
 
-def analyze_columns(aeis_file, metadata=None):
+def get_failure(aeis_file, column, error):
+    """
+    Describe the failure to analyze a column, or a whole file if `column`
+    is `None`. Must be called while handling `error`.
+    """
+    return {
+        'year': aeis_file.year,
+        'file': aeis_file.base_name,
+        'column': column,
+        'remainder': getattr(error, 'remainder', None),
+        'position': getattr(error, 'position', None),
+        'error': '%s: %s' % (type(error).__name__, error),
+        'traceback': traceback.format_exc(),
+    }
+
+
+class BatchReport(object):
+    """
+    Collects failures in batch mode instead of raising or reloading.
+    """
+    def __init__(self):
+        self.failures = []
+
+    def __repr__(self):
+        n_files = len(set((f['year'], f['file']) for f in self.failures))
+        return '<BatchReport failures=%d files=%d>' % (
+            len(self.failures), n_files)
+
+    def analyze(self, aeis_file, column, analyzer, metadata):
+        try:
+            analysis = analyze_column(aeis_file, column, analyzer, metadata)
+            return analysis, analyzer
+        except Exception as e:
+            self.failures.append(get_failure(aeis_file, column, e))
+            return None, analyzer
+
+    def summarize(self):
+        counts = collections.Counter(
+            '{}/{}'.format(f['year'], f['file']) for f in self.failures
+        )
+        return {
+            'failures': len(self.failures),
+            'failures_by_file': dict(counts),
+        }
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            report = {'summary': self.summarize(), 'failures': self.failures}
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+def analyze_unit(unit):
+    """
+    Analyze a single (file, column) unit of work in a pool worker.
+
+    Errors are returned rather than raised so that the writer can handle
+    them exactly as it would in a serial run.
+    """
+    aeis_file, column = unit
+    try:
+        analyzer = get_analyzer(aeis_file)
+        analysis = analyze_column(aeis_file, column, analyzer, metadata={})
+        return column, analysis, None
+    except Exception as e:
+        return column, None, get_failure(aeis_file, column, e)
+
+
+def get_pool_analyze(pool, jobs, plan, cache, report=None):
+    """
+    Fan out the columns of every planned file to a process pool.
+
+    Returns a function that may replace `analyze_column_in_loop` in the
+    writer. Columns that share a cache key share a unit of work, and the
+    writer looks up each (path, column) by the unit planned for it.
+    Columns that weren't planned, or whose analyzer has changed since
+    (like after a reload), are analyzed in the writer instead.
+    """
+    units = []
+    planned = {}
+    unit_indexes = {}
+    for aeis_file, columns in plan:
+        if report is None:
+            analyzer = get_analyzer_in_loop(aeis_file)
+        else:
+            try:
+                analyzer = get_analyzer(aeis_file)
+            except RuntimeError:
+                # The writer reports the missing analyzer
+                continue
+
+        for column in sorted(columns):
+            key = cache.get_key(analyzer, aeis_file.year, column)
+            if key not in planned:
+                if cache.has(analyzer, aeis_file.year, column):
+                    continue
+                planned[key] = len(units)
+                units.append((aeis_file, column))
+            unit_indexes[aeis_file.path, column] = (planned[key], key)
+
+    chunksize = max(1, min(64, len(units) // (jobs * 16)))
+    results = pool.imap(analyze_unit, units, chunksize=chunksize)
+    outcomes = []
+
+    def get_outcome(index):
+        while len(outcomes) <= index:
+            outcomes.append(next(results))
+        return outcomes[index]
+
+    def analyze(aeis_file, column, analyzer, metadata):
+        index, key = unit_indexes.get((aeis_file.path, column), (None, None))
+        if key != cache.get_key(analyzer, aeis_file.year, column) or \
+                get_outcome(index) is None:
+            if report is not None:
+                return report.analyze(aeis_file, column, analyzer, metadata)
+            return analyze_column_in_loop(aeis_file, column, analyzer,
+                                          metadata)
+
+        _, analysis, failure = outcomes[index]
+        if failure and report is not None:
+            # Keep the failure for the other files that share the unit
+            report.failures.append(dict(
+                failure, year=aeis_file.year, file=aeis_file.base_name))
+            return None, analyzer
+        elif failure:
+            # Retry in the writer, which raises or reloads like a serial run
+            logger.error(failure['traceback'])
+            return analyze_column_in_loop(aeis_file, column, analyzer,
+                                          metadata)
+
+        # The writer caches the analysis, so the unit isn't needed again
+        outcomes[index] = None
+
+        # Attach the metadata the writer has collected so far
+        column_metadata = metadata.get(column, {})
+        column_metadata['decomposition'] = \
+            analysis['metadata']['decomposition']
+        analysis['metadata'] = column_metadata
+        return analysis, analyzer
+
+    return analyze
+
+
+def analyze_columns(aeis_file, metadata=None, cache=None, analyze=None,
+                    report=None):
+    """
+    Yield the analysis of each column in the file.
+
+    In batch mode, when a `report` is given, failures are recorded in the
+    report and skipped instead of being raised or reloaded.
+    """
     metadata = metadata if metadata is not None else {}
+    cache = cache if cache is not None else get_or_create_cache()
     columns = list(get_columns(aeis_file, metadata=metadata))
-    analyzer = get_analyzer_in_loop(aeis_file)
+    if report is None:
+        analyze = analyze or analyze_column_in_loop
+        analyzer = get_analyzer_in_loop(aeis_file)
+    else:
+        analyze = analyze or report.analyze
+        try:
+            analyzer = get_analyzer(aeis_file)
+        except RuntimeError as e:
+            report.failures.append(get_failure(aeis_file, None, e))
+            return
 
     n_analyzed = 0
     for column in sorted(columns):
-        # Keep analyzing until we get it right...
-        analysis, analyzer = analyze_column_in_loop(column, analyzer, metadata)
+        # Reuse the analysis of a column we've already seen this year
+        analysis = cache.get(analyzer, aeis_file.year, column)
+        if analysis is None:
+            # Keep analyzing until we get it right...
+            analysis, analyzer = analyze(aeis_file, column, analyzer,
+                                         metadata)
+            if analysis is None:
+                continue
+            cache.set(analyzer, aeis_file.year, column, analysis)
 
         # Report analysis
         logger.debug(pprint.pformat(analysis))
@@ -159,7 +264,7 @@ def analyze_columns(aeis_file, metadata=None):
             descriptions = analysis['metadata'].get('descriptions', [])
             analysis['metadata']['layouts'] = list(layouts)
             analysis['metadata']['descriptions'] = list(descriptions)
-            print json.dumps(analysis)
+            print json.dumps(analysis, sort_keys=True)
 
         # Report progress
         n_analyzed += 1
@@ -172,24 +277,71 @@ def analyze_columns(aeis_file, metadata=None):
 if __name__ == '__main__':
     root = sys.argv[1]
 
-    # Get all analyzed columns
-    metadata = get_or_create_metadata(root)
-    analysis = get_or_create_analysis(root)
-
     # Decompose column analysis
     if '--decompose' in sys.argv:
         column = sys.argv[-1]
-        import pprint; pprint.pprint(analysis[column])
+        import pprint; pprint.pprint(get_analysis(root)[column])
         exit()
 
+    # Get all analyzed columns
+    analysis = get_or_create_analysis(root)
+
+    metadata = get_or_create_metadata(root)
+    cache = get_or_create_cache(persist='--cache' in sys.argv)  # XXX
+    report = BatchReport() if '--batch' in sys.argv else None  # XXX
+
     # Get files to process
     files = sorted(get_files(root), key=lambda f: f.year, reverse=True)
     files = (f for f in files if f.year in (1994, 2012, 2013))
     # files = (f for f in files if f.year in (2013,))
     # files = (f for f in files if f.root_name == 'prof')
 
+    # Profile analyzers if requested, which only works in this process
+    jobs = get_option('--jobs', default=1, type=int)
+    profile_path = get_option('--profile')
+    flamegraph_path = get_option('--flamegraph')
+    if profile_path or flamegraph_path:
+        profiler = instrument.enable()
+        if jobs > 1:
+            logger.warning('analyzing serially to profile analyzers')
+            jobs = 1
+
+    # Analyze columns in a process pool if requested
+    analyze = None
+    if jobs > 1:
+        files = list(files)
+        plan = [(f, list(get_columns(f, metadata={}))) for f in files]
+        pool = multiprocessing.Pool(jobs)
+        analyze = get_pool_analyze(pool, jobs, plan, cache, report=report)
+
     # Update analysis
     for aeis_file in files:
-        for column in analyze_columns(aeis_file, metadata=metadata):
-            key = column['key']
-            analysis[key] = column
+        columns = analyze_columns(aeis_file, metadata=metadata, cache=cache,
+                                  analyze=analyze, report=report)
+        analysis.update((column['key'], column) for column in columns)
+
+    if jobs > 1:
+        pool.close()
+        pool.join()
+
+    logger.info(cache)
+    cache.close()
+
+    # Report profiling results
+    if profile_path:
+        sort = get_option('--sort', default='seconds')
+        with open(profile_path, 'w') as f:
+            profiler.write_report(f, sort=sort)
+    if flamegraph_path:
+        with open(flamegraph_path, 'w') as f:
+            profiler.write_flamegraph(f)
+
+    # Summarize failures in batch mode
+    if report is not None:
+        report.write(get_option('--report', default='analysis_errors.json'))
+        logger.info(report)
+        for name, count in sorted(report.summarize()['failures_by_file']
+                                  .items()):
+            logger.info('%s: %d failed columns', name, count)
+        if report.failures:
+            sys.exit(1)
@@ -0,0 +1,364 @@
+"""
+Benchmark the column analyzers over a fixed corpus of columns.
+
+The corpus in `benchmarks/corpus.json` is generated from the analyzers'
+own DSL tables, or extracted from the layouts of real data:
+
+    $ python -m benchmarks.analyzers --generate
+    $ python -m benchmarks.analyzers --extract data
+
+Each analyzer is timed over its columns, and results are compared to
+the baselines in `benchmarks/baselines.json`, if any. Regressions beyond
+the tolerance (25% by default) are flagged and exit with status 1.
+
+    $ python -m benchmarks.analyzers --save
+    $ python -m benchmarks.analyzers --tolerance 0.1
+
+To see which DSL rules are slow or dead, profile the analyzers instead:
+
+    $ python -m benchmarks.analyzers --profile analyzers.txt --sort failed
+    $ python -m benchmarks.analyzers --flamegraph analyzers.folded
+
+Allocations are counted as the container objects created (and still
+alive) while analyzing each column, according to the garbage collector.
+"""
+from __future__ import absolute_import
+
+import gc
+import json
+import logging
+import os
+import random
+import re
+import sre_constants
+import sre_parse
+import sys
+import timeit
+
+from aeis import analyzers
+from aeis import instrument
+from aeis import registry
+from aeis.fields import DummyAEISFile
+from aeis.files import get_files
+from aeis.fields import get_columns
+from aeis.options import get_option
+
+
+logging.basicConfig()
+logger = logging.getLogger('aeis')
+logger.setLevel(logging.INFO)
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+CORPUS_PATH = os.path.join(DIRECTORY, 'corpus.json')
+BASELINES_PATH = os.path.join(DIRECTORY, 'baselines.json')
+
+# Analyzers to benchmark, with the year of data they analyze
+BENCHMARKS = (
+    ('analyze_cad', 2012),
+    ('analyze_comp', 2012),
+    ('analyze_fin', 2011),
+    ('analyze_fin_2012', 2012),
+    ('analyze_part1_2013', 2013),
+    ('analyze_perf_2013', 2013),
+    ('analyze_prof_2013', 2013),
+    ('analyze_staf', 2012),
+    ('analyze_stud', 2012),
+    ('analyze_taas', 1998),
+    ('analyze_taks', 2011),
+)
+
+LEVEL_CODES = 'CDRS'
+MEASURE_CODES = ('', 'A', 'C', 'D', 'K', 'N', 'P', 'R', 'T')
+CHARACTERS = {
+    sre_constants.CATEGORY_DIGIT: '0123456789',
+    sre_constants.CATEGORY_WORD: '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ',
+}
+
+
+def get_aeis_file(year):
+    return DummyAEISFile('benchmark', 'c', '.', year)
+
+
+def get_partials(analyzer, aeis_file, column):
+    return [partial for partial, data in analyzer(aeis_file, column)]
+
+
+def is_analyzed(analyzer, aeis_file, column):
+    """
+    Determine whether the analyzer consumes the whole column.
+    """
+    try:
+        return ''.join(get_partials(analyzer, aeis_file, column)) == column
+    except Exception:
+        return False
+
+
+def generate_pattern(items, names, metadata, rng):
+    """
+    Generate a random string from a parsed regex, preferring the known
+    values of named groups from the DSL metadata.
+    """
+    parts = []
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            parts.append(chr(av))
+        elif op == sre_constants.ANY:
+            parts.append(rng.choice(CHARACTERS[sre_constants.CATEGORY_WORD]))
+        elif op == sre_constants.IN:
+            characters = []
+            for in_op, in_av in av:
+                if in_op == sre_constants.LITERAL:
+                    characters.append(chr(in_av))
+                elif in_op == sre_constants.RANGE:
+                    characters.extend(map(chr, range(in_av[0], in_av[1] + 1)))
+                elif in_op == sre_constants.CATEGORY:
+                    characters.extend(CHARACTERS.get(in_av, ''))
+            parts.append(rng.choice(characters))
+        elif op == sre_constants.BRANCH:
+            branch = rng.choice(av[1])
+            parts.append(generate_pattern(branch, names, metadata, rng))
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            low, high, subpattern = av
+            for _ in range(rng.randint(low, min(high, low + 2))):
+                parts.append(
+                    generate_pattern(subpattern, names, metadata, rng))
+        elif op == sre_constants.SUBPATTERN:
+            group, subpattern = av[0], av[-1]
+            values = metadata.get(names.get(group))
+            if isinstance(values, dict) and values:
+                parts.append(rng.choice(sorted(values)))
+            else:
+                parts.append(
+                    generate_pattern(subpattern, names, metadata, rng))
+
+    return ''.join(parts)
+
+
+def generate_transition(transition, metadata, rng):
+    if re.match(r'^\w+$', transition):
+        return transition
+
+    parsed = sre_parse.parse(transition, re.X)
+    names = dict((i, n) for n, i in parsed.pattern.groupdict.items())
+    return generate_pattern(list(parsed), names, metadata, rng)
+
+
+def generate_column(tree, rng):
+    """
+    Generate a random column by walking the DSL tree of an analyzer.
+    """
+    parts = [rng.choice(LEVEL_CODES)]
+    while tree:
+        transition = rng.choice(sorted(tree))
+        subtree = tree[transition]
+        if isinstance(subtree, dict):
+            metadata, subtrees = subtree, []
+        else:
+            metadata, subtrees = subtree[0], subtree[1:]
+
+        parts.append(generate_transition(transition, metadata, rng))
+        tree = rng.choice(subtrees) if subtrees else None
+
+    parts.append(rng.choice(MEASURE_CODES))
+    return ''.join(parts)
+
+
+def generate_corpus(size=500, attempts=50000, seed=0):
+    corpus = {}
+    for name, year in BENCHMARKS:
+        rng = random.Random(seed)
+        analyzer = getattr(analyzers, name)
+        aeis_file = get_aeis_file(year)
+        tree = analyzer.get_dsl(aeis_file)
+
+        columns = set()
+        for _ in xrange(attempts):
+            column = generate_column(tree, rng)
+            if is_analyzed(analyzer, aeis_file, column):
+                columns.add(column)
+            if len(columns) >= size:
+                break
+
+        logger.info('%s: generated %d columns', name, len(columns))
+        corpus[name] = {'year': year, 'columns': sorted(columns)}
+
+    return corpus
+
+
+def extract_corpus(root, size=500):
+    """
+    Extract the corpus from the layouts of real data files.
+    """
+    analyzer_names = dict(BENCHMARKS)
+    corpus = {}
+    for aeis_file in sorted(get_files(root), key=lambda f: f.path):
+        analyzer = registry.resolve(aeis_file.root_name, aeis_file.year)
+        name = analyzer.__name__ if analyzer else None
+        if name not in analyzer_names:
+            continue
+        elif aeis_file.year != analyzer_names[name]:
+            continue
+
+        entry = corpus.setdefault(name, {'year': aeis_file.year,
+                                         'columns': []})
+        columns = set(entry['columns'])
+        columns.update(get_columns(aeis_file, metadata={}))
+        entry['columns'] = sorted(columns)[:size]
+
+    return corpus
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def benchmark(analyzer, year, columns, repeat=5):
+    """
+    Time an analyzer over the columns, and count its allocations.
+    """
+    aeis_file = get_aeis_file(year)
+    timer = timeit.default_timer
+
+    # Warm up caches, like that of compiled regexes
+    for column in columns:
+        get_partials(analyzer, aeis_file, column)
+
+    # Count the objects each analysis leaves alive while the collector
+    # is disabled, and keep them alive until we're done counting.
+    gc.collect()
+    gc.disable()
+    try:
+        results = []
+        allocations = 0
+        for column in columns:
+            count = gc.get_count()[0]
+            results.append(list(analyzer(aeis_file, column)))
+            allocations += gc.get_count()[0] - count
+        del results
+    finally:
+        gc.enable()
+
+    latencies = []
+    start = timer()
+    for _ in xrange(repeat):
+        for column in columns:
+            column_start = timer()
+            for _ in analyzer(aeis_file, column):
+                pass
+            latencies.append(timer() - column_start)
+    elapsed = timer() - start
+
+    return {
+        'columns': len(columns),
+        'columns_per_sec': len(latencies) / elapsed,
+        'p99_us': 1e6 * percentile(latencies, 0.99),
+        'allocations_per_column': 1.0 * allocations / len(columns),
+    }
+
+
+def get_regressions(result, baseline, tolerance):
+    if result['columns_per_sec'] < (1 - tolerance) * \
+            baseline['columns_per_sec']:
+        yield 'columns/sec'
+    if result['p99_us'] > (1 + tolerance) * baseline['p99_us']:
+        yield 'p99'
+    if result['allocations_per_column'] > (1 + tolerance) * \
+            baseline['allocations_per_column']:
+        yield 'allocations'
+
+
+def profile(corpus, only, profile_path, flamegraph_path, sort='seconds'):
+    profiler = instrument.enable()
+    try:
+        for name, entry in sorted(corpus.items()):
+            if only and name != only:
+                continue
+            analyzer = getattr(analyzers, name)
+            aeis_file = get_aeis_file(entry['year'])
+            for column in entry['columns']:
+                get_partials(analyzer, aeis_file, column)
+    finally:
+        instrument.disable()
+
+    if profile_path:
+        with open(profile_path, 'w') as f:
+            profiler.write_report(f, sort=sort)
+    if flamegraph_path:
+        with open(flamegraph_path, 'w') as f:
+            profiler.write_flamegraph(f)
+
+    return 0
+
+
+def main(argv):
+    if '--generate' in argv:
+        corpus = generate_corpus()
+    elif '--extract' in argv:
+        corpus = extract_corpus(get_option('--extract', argv=argv))
+    else:
+        corpus = None
+
+    if corpus is not None:
+        with open(CORPUS_PATH, 'w') as f:
+            json.dump(corpus, f, indent=2, sort_keys=True)
+        return 0
+
+    with open(CORPUS_PATH) as f:
+        corpus = json.load(f)
+
+    baselines = {}
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH) as f:
+            baselines = json.load(f)
+
+    repeat = get_option('--repeat', default=5, type=int, argv=argv)
+    tolerance = get_option('--tolerance', default=0.25, type=float, argv=argv)
+    only = get_option('--only', argv=argv)
+
+    profile_path = get_option('--profile', argv=argv)
+    flamegraph_path = get_option('--flamegraph', argv=argv)
+    if profile_path or flamegraph_path:
+        return profile(corpus, only, profile_path, flamegraph_path,
+                       sort=get_option('--sort', 'seconds', argv=argv))
+
+    results = {}
+    n_regressions = 0
+    row = '{:<20} {:>5} {:>8} {:>12} {:>10} {:>12}  {}'
+    print row.format('analyzer', 'year', 'columns', 'columns/sec',
+                     'p99 (us)', 'allocs/col', 'regressions')
+    for name, entry in sorted(corpus.items()):
+        if only and name != only:
+            continue
+
+        analyzer = getattr(analyzers, name)
+        result = benchmark(analyzer, entry['year'], entry['columns'],
+                           repeat=repeat)
+        results[name] = result
+
+        regressions = []
+        if name in baselines:
+            regressions = list(
+                get_regressions(result, baselines[name], tolerance))
+            n_regressions += len(regressions)
+
+        print row.format(
+            name,
+            entry['year'],
+            result['columns'],
+            '%.0f' % result['columns_per_sec'],
+            '%.1f' % result['p99_us'],
+            '%.1f' % result['allocations_per_column'],
+            'REGRESSION: ' + ', '.join(regressions) if regressions else ''
+        )
+
+    if '--save' in argv:
+        baselines.update(results)
+        with open(BASELINES_PATH, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+
+    return 1 if n_regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,179 @@
+"""
+Benchmark the generation and serialization of Elasticsearch documents.
+
+Documents are generated from a synthetic campus file, with a key and a
+name column and `--columns` measure columns for `--records` campuses,
+and serialized into bulk chunks without sending them anywhere:
+
+    $ python -m benchmarks.indexing
+    $ python -m benchmarks.indexing --records 20000 --columns 200
+
+Each layout (a document per cell, or a wide document per record) is
+timed over the whole file, and results are compared to the baselines in
+`benchmarks/indexing.json`, if any. Regressions beyond the tolerance
+(25% by default) are flagged and exit with status 1.
+
+    $ python -m benchmarks.indexing --save
+
+To benchmark sending as well, index into a sink like `local` (see
+`aeis/sinks.py`) with `index.py data --sink local`.
+"""
+from __future__ import absolute_import
+
+import json
+import os
+import random
+import sys
+import timeit
+
+from aeis.bulk import iter_chunks
+from aeis.documents import WIDE_INDEX, iter_row_lines
+from aeis.options import get_option
+
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+BASELINES_PATH = os.path.join(DIRECTORY, 'indexing.json')
+
+# Layouts to benchmark, with whether they're wide and their index
+BENCHMARKS = (
+    ('cells', False, 'aeis'),
+    ('wide', True, WIDE_INDEX),
+)
+
+RACES = ('all', 'asian', 'black', 'hispanic', 'white')
+
+
+class SyntheticAEISFile(object):
+    """
+    A campus file of random enrollment counts and rates, kept in memory.
+    """
+    def __init__(self, n_records=10000, n_columns=100, year=2012, seed=0):
+        self.year = year
+        self.file_name = 'cstud'
+        self.base_name = 'cstud.dat'
+        self.root_name = 'stud'
+        self.level = 'campus'
+        self.key_column = 'CAMPUS'
+        self.columns = ['CPET%03d%s' % (i, 'C' if i % 2 else 'P')
+                        for i in range(n_columns)]
+
+        rng = random.Random(seed)
+        self.records = []
+        for i in xrange(n_records):
+            record = {'CAMPUS': '%09d' % (1000000 + i),
+                      'CAMPNAME': 'CAMPUS %d' % i}
+            for column in self.columns:
+                if column.endswith('C'):
+                    record[column] = rng.randint(-1, 5000)
+                else:
+                    record[column] = round(rng.uniform(0, 100), 1)
+            self.records.append(record)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def get_analysis(self):
+        analysis = {
+            'CAMPUS': {'key': 'CAMPUS', 'field': 'key', 'level': 'campus',
+                       'metadata': {}},
+            'CAMPNAME': {'key': 'CAMPNAME', 'field': 'name',
+                         'level': 'campus', 'metadata': {}},
+        }
+        for i, column in enumerate(self.columns):
+            analysis[column] = {
+                'key': column,
+                'field': 'enrollment',
+                'level': 'campus',
+                'race': RACES[i % len(RACES)],
+                'grade': str(i % 12 + 1),
+                'measure': 'count' if column.endswith('C') else 'percent',
+                'version': self.year,
+                'metadata': {'description': 'Enrollment %d' % i},
+            }
+        return analysis
+
+
+def benchmark(wide, analysis, aeis_file, index, repeat=3):
+    """
+    Time the generation and serialization of a file's documents into
+    bulk chunks, taking the fastest of `repeat` runs.
+    """
+    timer = timeit.default_timer
+    best = None
+    for _ in xrange(repeat):
+        n_docs = 0
+        n_bytes = 0
+        start = timer()
+        lines = iter_row_lines(analysis, aeis_file, index=index, wide=wide)
+        for count, body, row in iter_chunks(lines):
+            n_docs += count
+            n_bytes += len(body)
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return {
+        'docs': n_docs,
+        'docs_per_sec': n_docs / best,
+        'mb_per_sec': n_bytes / 1e6 / best,
+    }
+
+
+def get_regressions(result, baseline, tolerance):
+    for key, name in (('docs_per_sec', 'docs/sec'), ('mb_per_sec', 'MB/sec')):
+        if result[key] < (1 - tolerance) * baseline[key]:
+            yield name
+
+
+def main(argv):
+    aeis_file = SyntheticAEISFile(
+        n_records=get_option('--records', default=10000, type=int,
+                             argv=argv),
+        n_columns=get_option('--columns', default=100, type=int, argv=argv),
+    )
+    analysis = aeis_file.get_analysis()
+
+    baselines = {}
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH) as f:
+            baselines = json.load(f)
+
+    repeat = get_option('--repeat', default=3, type=int, argv=argv)
+    tolerance = get_option('--tolerance', default=0.25, type=float, argv=argv)
+    only = get_option('--only', argv=argv)
+
+    results = {}
+    n_regressions = 0
+    row = '{:<8} {:>10} {:>12} {:>8}  {}'
+    print row.format('layout', 'docs', 'docs/sec', 'MB/sec', 'regressions')
+    for name, wide, index in BENCHMARKS:
+        if only and name != only:
+            continue
+
+        result = benchmark(wide, analysis, aeis_file, index,
+                           repeat=repeat)
+        results[name] = result
+
+        regressions = []
+        if name in baselines:
+            regressions = list(
+                get_regressions(result, baselines[name], tolerance))
+            n_regressions += len(regressions)
+
+        print row.format(
+            name,
+            result['docs'],
+            '%.0f' % result['docs_per_sec'],
+            '%.1f' % result['mb_per_sec'],
+            'REGRESSION: ' + ', '.join(regressions) if regressions else ''
+        )
+
+    if '--save' in argv:
+        baselines.update(results)
+        with open(BASELINES_PATH, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+
+    return 1 if n_regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
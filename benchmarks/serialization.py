@@ -0,0 +1,151 @@
+"""
+Benchmark the serialization of the cells that `parse.py` writes.
+
+Cells come from the same synthetic campus file as `benchmarks.indexing`,
+and each is serialized in three ways:
+
+- `dumps`, the document of each cell built as a dict and serialized by
+  `json.dumps`, as `parse.iter_lines` does
+- `spliced`, the key and value of each cell spliced into its column's
+  serialized document, as `parse.py` writes JSON lines
+- `msgpack`, the same with msgpack maps, if `msgpack` is installed
+
+    $ python -m benchmarks.serialization
+    $ python -m benchmarks.serialization --records 20000 --columns 200
+
+Before timing, every spliced document is checked to decode to the same
+document as `dumps`. Results are compared to the baselines in
+`benchmarks/serialization.json`, if any, and regressions beyond the
+tolerance (25% by default) are flagged and exit with status 1.
+
+    $ python -m benchmarks.serialization --save
+"""
+from __future__ import absolute_import
+
+import itertools
+import json
+import os
+import sys
+import timeit
+
+from aeis.documents import msgpack
+from aeis.options import get_option
+from benchmarks.indexing import SyntheticAEISFile, get_regressions
+import parse
+
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+BASELINES_PATH = os.path.join(DIRECTORY, 'serialization.json')
+
+# How many cells to check against `dumps`
+N_CHECKED = 10000
+
+
+def iter_dumps(aeis_file, analysis):
+    return parse.iter_lines(parse.parse_file(aeis_file), analysis)
+
+
+def iter_spliced(aeis_file, analysis):
+    return parse.iter_file_records(aeis_file, analysis, 'json')
+
+
+def iter_packed(aeis_file, analysis):
+    return parse.iter_file_records(aeis_file, analysis, 'msgpack')
+
+
+BENCHMARKS = [
+    ('dumps', iter_dumps, json.loads),
+    ('spliced', iter_spliced, json.loads),
+]
+if msgpack is not None:
+    BENCHMARKS.append(('msgpack', iter_packed, msgpack.unpackb))
+
+
+def check(iter_records, decode, aeis_file, analysis):
+    """
+    Check that the first cells decode to the same documents as `dumps`.
+    """
+    expected = itertools.islice(iter_dumps(aeis_file, analysis), N_CHECKED)
+    actual = iter_records(aeis_file, analysis)
+    for (key, line), (actual_key, record) in itertools.izip(expected, actual):
+        if actual_key != key or decode(record) != json.loads(line):
+            raise AssertionError('%r != %r' % (record, line))
+
+
+def benchmark(iter_records, aeis_file, analysis, repeat=3):
+    """
+    Time the serialization of a file's cells, taking the fastest of
+    `repeat` runs.
+    """
+    timer = timeit.default_timer
+    best = None
+    for _ in xrange(repeat):
+        n_cells = 0
+        n_bytes = 0
+        start = timer()
+        for key, record in iter_records(aeis_file, analysis):
+            n_cells += 1
+            n_bytes += len(record)
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return {
+        'docs': n_cells,
+        'docs_per_sec': n_cells / best,
+        'mb_per_sec': n_bytes / 1e6 / best,
+    }
+
+
+def main(argv):
+    aeis_file = SyntheticAEISFile(
+        n_records=get_option('--records', default=10000, type=int,
+                             argv=argv),
+        n_columns=get_option('--columns', default=100, type=int, argv=argv),
+    )
+    analysis = aeis_file.get_analysis()
+
+    baselines = {}
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH) as f:
+            baselines = json.load(f)
+
+    repeat = get_option('--repeat', default=3, type=int, argv=argv)
+    tolerance = get_option('--tolerance', default=0.25, type=float, argv=argv)
+    only = get_option('--only', argv=argv)
+
+    results = {}
+    n_regressions = 0
+    row = '{:<8} {:>10} {:>12} {:>8}  {}'
+    print row.format('format', 'cells', 'cells/sec', 'MB/sec', 'regressions')
+    for name, iter_records, decode in BENCHMARKS:
+        if only and name != only:
+            continue
+
+        check(iter_records, decode, aeis_file, analysis)
+        result = benchmark(iter_records, aeis_file, analysis, repeat=repeat)
+        results[name] = result
+
+        regressions = []
+        if name in baselines:
+            regressions = list(
+                get_regressions(result, baselines[name], tolerance))
+            n_regressions += len(regressions)
+
+        print row.format(
+            name,
+            result['docs'],
+            '%.0f' % result['docs_per_sec'],
+            '%.1f' % result['mb_per_sec'],
+            'REGRESSION: ' + ', '.join(regressions) if regressions else ''
+        )
+
+    if '--save' in argv:
+        baselines.update(results)
+        with open(BASELINES_PATH, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+
+    return 1 if n_regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
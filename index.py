@@ -1,89 +1,209 @@
+import functools
 import json
 import logging
+import multiprocessing
 import os
-import pprint
 import sys
 
-from elasticsearch import Elasticsearch
 from elasticsearch.client import IndicesClient
-from elasticsearch.helpers import streaming_bulk
 
-from aeis.analyzers import get_or_create_analysis
+from aeis.analysis import get_analysis
+from aeis.bulk import CHUNK_SIZE, MAX_CHUNK_BYTES, index_parallel
+from aeis.checkpoints import Checkpoint, DeadLetters, get_report
+from aeis.documents import WIDE_INDEX, iter_row_lines
 from aeis.files import get_files
-from aeis.keys import get_cdc_code
+from aeis.ledger import Ledger, iter_incremental_lines, iter_removed_lines
+from aeis.lifecycle import (MAPPINGS, WIDE_MAPPINGS, create_index,
+                            finish_index, swap_alias)
 from aeis.logging import logger
+from aeis.options import get_option
+from aeis.selection import Selection
+from aeis.sinks import get_sink
 
-ES_HOST = os.environ.get('ES_HOST', 'localhost:9200')
-
-def get_documents(root, files):
-    # Get all analyzed columns
-    analysis = get_or_create_analysis(root)
-    for aeis_file in files:
-        logger.info(aeis_file)
-        for i, record in enumerate(aeis_file):
-            key = get_cdc_code(record, level=aeis_file.level)
-            for column, value in record.items():
-                # Build the document source
-                data = analysis[column]
-                data.pop('metadata', None)
-                column = data['key']
-                data = dict(
-                    data,
-                    key=key,
-                    value=value,
-                    column=column,
-                    file=aeis_file.file_name,
-                    version=aeis_file.year
-                )
-                logger.debug(pprint.pformat(data))
-
-                # Build a globally unique ID
-                _id = '%s:%s:%d' % (key, column, aeis_file.year)
-
-                # Yield the document as a bulk action
-                yield {
-                    '_index': 'aeis',
-                    '_type': data['field'],
-                    '_id': _id,
-                    '_source': data
-                }
+# The default selection, next to this script rather than in the working
+# directory
+SELECTION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'selection.json')
+
+def get_file_documents(root, aeis_file, start=0, wide=False, index=None):
+    """
+    Yield the (row, lines) of a file's documents from its `start` row on.
+    """
+    logger.info(aeis_file)
+    index = index or (WIDE_INDEX if wide else 'aeis')
+    return iter_row_lines(get_analysis(root), aeis_file, index=index,
+                          wide=wide, start=start)
+
+
+def get_changed_documents(root, task, start=0, wide=False, index=None,
+                          alias=None, full=False):
+    """
+    Yield the (row, lines) of a file's new and changed documents, with
+    deletes for those that disappeared, or deletes for every document of
+    a removed file's path.
+
+    Changes are only known once the whole file was read, so the file is
+    loaded from its start, and every row is 0.
+    """
+    alias = alias or (WIDE_INDEX if wide else 'aeis')
+    index = index or alias
+    ledger = Ledger()
+    try:
+        if isinstance(task, basestring):
+            logger.info('removed %s', task)
+            lines = iter_removed_lines(ledger, alias, task, index)
+        else:
+            logger.info(task)
+            lines = iter_incremental_lines(ledger, alias, get_analysis(root),
+                                           task, index, wide=wide, full=full)
+        for line in lines:
+            yield 0, line
+    finally:
+        ledger.close()
 
 
 if __name__ == '__main__':
     root = sys.argv[1]
 
-    # Configure Elasticsearch index
-    es = Elasticsearch(ES_HOST)
-    indices = IndicesClient(es)
-
-    # Recreate index if necessary
-    if '--recreate' in sys.argv:
-        indices.delete('aeis')
-        indices.create(index='aeis', body={
-            'index': {
-                'mapping': {
-                    'ignore_malformed': True,
-                    'coerce': False
-                }
-            }
-        })
-
-    # Get documents to index
+    # Configure the sink of bulk requests (Elasticsearch by default), with
+    # a connection for each sender
+    threads = get_option('--threads', default=4, type=int)
+    sink = get_option('--sink', default='es')
+    es = get_sink(sink, threads=threads)
+
+    # Resume a run that died from its checkpoint, with its settings, or
+    # start a new one
+    checkpoint_path = get_option('--checkpoint', default='checkpoint.json')
+    resume = '--resume' in sys.argv  # XXX
+    if resume:
+        if not os.path.exists(checkpoint_path):
+            raise SystemExit('There is no run to resume in %s' %
+                             checkpoint_path)
+        checkpoint = Checkpoint.load(checkpoint_path)
+        settings = checkpoint.settings
+        logger.info('resuming %r', checkpoint)
+    else:
+        settings = {
+            'wide': '--wide' in sys.argv,  # XXX
+            'recreate': '--recreate' in sys.argv,  # XXX
+            'incremental': '--incremental' in sys.argv,  # XXX
+            'select': get_option('--select', default=SELECTION_PATH),
+        }
+    wide = settings['wide']
+    recreate = settings['recreate']
+    incremental = settings['incremental']
+    alias = WIDE_INDEX if wide else 'aeis'
+
+    # The ledger records what a cluster holds, so only a cluster may load
+    # its changes
+    if incremental and sink.partition(':')[0] != 'es':
+        raise SystemExit('--incremental needs an Elasticsearch sink')
+
+    # Select the files and columns to index
+    try:
+        selection = Selection.load(settings.get('select', SELECTION_PATH))
+    except (IOError, ValueError) as e:
+        raise SystemExit(str(e))
+
+    # Load a new version of the index behind the alias if requested, so
+    # that it can be read until it's replaced
+    if recreate:
+        if not hasattr(es, 'transport'):
+            raise SystemExit('--recreate needs an Elasticsearch sink')
+        indices = IndicesClient(es)
+        if not resume:
+            mappings = WIDE_MAPPINGS if wide else MAPPINGS
+            settings['index'] = create_index(indices, alias,
+                                             mappings=mappings)
+        index_name = settings['index']
+    else:
+        index_name = alias
+
+    if not resume:
+        checkpoint = Checkpoint(checkpoint_path, settings=settings)
+        checkpoint.save()
+
+    # Get the files to index, which only read their selected columns
     files = sorted(get_files(root), key=lambda f: f.year, reverse=False)
-    files = (f for f in files if f.year in (1994, 2012, 2013))
+    files = selection.apply(files, get_analysis(root))
 
     # TESTING
-    files = (f for f in files if 'staar' not in f.root_name)
     # files = (f for f in files if f.year in (2013,))
     # files = (f for f in files if f.root_name in ('ref', 'prof'))
     # files = (f for f in files if 'taks' not in f.root_name)
 
-    # Index to Elasticsearch
-    documents = get_documents(root, files)
-    for result in streaming_bulk(
+    # Only send documents that changed since the last load, according to
+    # the ledger, and delete those of files that were removed. A resumed
+    # run keeps what the files it already loaded staged.
+    if incremental:
+        ledger = Ledger()
+        if not resume:
+            ledger.clear_pending()
+        tasks = list(files)
+        if not recreate:
+            tasks.extend(p for p in ledger.get_paths(alias)
+                         if not os.path.exists(p))
+        get_actions = functools.partial(
+            get_changed_documents, root, wide=wide, index=index_name,
+            alias=alias, full=recreate)
+    else:
+        tasks = files
+        get_actions = functools.partial(get_file_documents, root, wide=wide,
+                                        index=index_name)
+
+    # Items that still fail after retries are set aside instead of failing
+    # the run, if requested
+    dead_letters = None
+    if '--dead-letters' in sys.argv:  # XXX
+        dead_letters = DeadLetters(get_option('--dead-letters'),
+                                   errors=checkpoint.dead_letters,
+                                   lock=checkpoint.lock)
+
+    # Index to Elasticsearch, generating documents in a process per file
+    # and sending them with several threads
+    jobs = get_option('--jobs', default=multiprocessing.cpu_count(),
+                      type=int)
+    index_parallel(
         es,
-        documents,
-        chunk_size=300,
-        raise_on_error=True
-    ):
-        pass
+        get_actions,
+        tasks,
+        jobs=jobs,
+        threads=threads,
+        chunk_size=get_option('--chunk-size', default=CHUNK_SIZE, type=int),
+        max_chunk_bytes=get_option('--chunk-bytes', default=MAX_CHUNK_BYTES,
+                                   type=int),
+        checkpoint=checkpoint,
+        dead_letters=dead_letters,
+    )
+
+    # Every document was indexed, so the ledger can be updated, unless
+    # this run or the one it resumed dead-lettered any
+    if incremental and checkpoint.dead_letters:
+        logger.warning('not updating the ledger, because of dead letters')
+    elif incremental:
+        ledger.commit_pending(reset_alias=alias if recreate else None)
+        ledger.close()
+
+    if hasattr(es, 'close'):
+        es.close()
+
+    if recreate:
+        finish_index(indices, index_name,
+                     replicas=get_option('--replicas', default=1, type=int))
+        swap_alias(indices, alias, index_name)
+
+    # Report what was skipped, now that the run is over
+    report = get_report(checkpoint, dead_letters)
+    logger.info('skipped %d files and resumed %d, %d dead letters',
+                len(report['skipped_files']), len(report['resumed_files']),
+                len(dead_letters or []))
+    report_path = get_option('--report')
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    checkpoint.remove()
+
+    if dead_letters is not None:
+        dead_letters.close()
+        if dead_letters:
+            sys.exit(1)
@@ -6,21 +6,32 @@ import pprint
 import shutil
 import sys
 
-from aeis.analyzers import get_or_create_analysis
+from aeis.analysis import get_analysis
+from aeis.documents import PackedTemplate, encode_string, get_templates
 from aeis.files import get_files
 from aeis.keys import get_cdc_code
 from aeis.logging import logger
+from aeis.options import get_option
+from aeis.sorting import MAX_BUFFERED_BYTES, iter_groups, iter_sorted
+from aeis.writers import PooledWriter
 
 
 Data = namedtuple('Data', ['key', 'value', 'column', 'file', 'version'])
 
+# The suffix of entity files in each format
+SUFFIXES = {
+    'json': '.json.txt',
+    'msgpack': '.msgpack',
+}
+
 
 def parse_file(aeis_file):
     try:
         file_ = aeis_file.file_name
         version = aeis_file.year
+        key_column = aeis_file.key_column
         for record in aeis_file:
-            key = get_cdc_code(record, level=aeis_file.level)
+            key = get_cdc_code(record, aeis_file.level, key_column)
             for column, value in record.items():
                 data = Data(key, value, column, file_, version)
                 yield key, data
@@ -28,39 +39,90 @@ def parse_file(aeis_file):
         sys.exit()
 
 
-def flush_from_queue(root, queue, analysis=None):
-    stream = None
-    last_key = None
+def iter_lines(queue, analysis):
+    """
+    Yield the (key, JSON) of each cell, building its document as a dict.
+    `iter_file_records` splices the same documents much faster, and is
+    checked against this in `benchmarks/serialization.py`.
+    """
     for key, data in queue:
         # Override default analysis data with more specific data
         data = dict(analysis[data.column], **data._asdict())
         data.pop('metadata', None)
-        if key != last_key:
-            if stream:
-                stream.close()
-            filename = '{}.json.txt'.format(key)
-            path = os.path.join(root, 'target', filename)
-            stream = open(path, 'a')
-            last_key = key
+        yield key, json.dumps(data)
+
+
+def iter_file_records(aeis_file, analysis, format='json'):
+    """
+    Yield the (key, record) of each cell, spliced into the serialized
+    document of its column: a JSON line, or a msgpack map.
+    """
+    level = aeis_file.level
+    key_column = aeis_file.key_column
+    if format == 'json':
+        get_template = get_templates(analysis, aeis_file)
+        for record in aeis_file:
+            key = get_cdc_code(record, level, key_column)
+            encoded_key = encode_string(key)
+            for column, value in record.iteritems():
+                line = get_template(column).render_source(encoded_key, value)
+                yield key, line + '\n'
+    elif format == 'msgpack':
+        get_template = get_templates(analysis, aeis_file,
+                                     template_class=PackedTemplate)
+        for record in aeis_file:
+            key = get_cdc_code(record, level, key_column)
+            for column, value in record.iteritems():
+                yield key, get_template(column).render(key, value)
+    else:
+        raise ValueError('Unknown format %r' % format)
+
 
-        content = json.dumps(data)
-        stream.write(content + '\n')
+def iter_files_records(files, analysis, format='json'):
+    for aeis_file in files:
+        logger.info('parsing {}...'.format(aeis_file))
+        for pair in iter_file_records(aeis_file, analysis, format):
+            yield pair
 
 
-def main(script, root):
+def main(script, root, *args):
     files = sorted(get_files(root), key=lambda f: f.year, reverse=True)
     files = (f for f in files if f.year in (1994, 2012, 2013))
-    analysis = get_or_create_analysis(root)
+    analysis = get_analysis(root)
 
     # TESTING
     files = (f for f in files if f.year in (2013,))
     files = (f for f in files if f.root_name.startswith('prof'))
 
-    # Parse all files
-    for aeis_file in files:
-        logger.info('parsing {}...'.format(aeis_file))
-        queue = parse_file(aeis_file)
-        flush_from_queue(root, queue, analysis=analysis)
+    # Write each entity's file fresh, unless appending to earlier runs
+    target = os.path.join(root, 'target')
+    mode = 'append' if '--append' in args else 'replace'
+    format = get_option('--format', default='json', argv=args)
+    if format not in SUFFIXES:
+        raise SystemExit('Unknown format {!r}'.format(format))
+    records = iter_files_records(files, analysis, format)
+
+    if '--sort' in args:
+        # Sort the cells of all files by entity, spilling them to disk as
+        # needed, so that each entity's file is written once, at once
+        writer = PooledWriter(target, suffix=SUFFIXES[format], mode=mode,
+                              max_open=1)
+        pairs = iter_sorted(
+            records,
+            max_buffered_bytes=get_option('--sort-bytes',
+                                          default=MAX_BUFFERED_BYTES,
+                                          type=int, argv=args),
+            directory=get_option('--sort-dir', argv=args))
+        for key, lines in iter_groups(pairs):
+            writer.write_all(key, lines)
+    else:
+        # Parse all files
+        writer = PooledWriter(target, suffix=SUFFIXES[format], mode=mode)
+        for key, record in records:
+            writer.write(key, record)
+
+    writer.close()
+    logger.info(writer)
 
 
 if __name__ == '__main__':
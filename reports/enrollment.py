@@ -8,6 +8,9 @@ Usage:
     python reports/enrollment.py --district > district_enrollment_2013.csv
     python reports/enrollment.py --campus > campus_enrollment_2013.csv
 
+Add `--wide` to read the wide layout of one document per entity, year
+and dataset, as indexed by `python index.py data --wide`.
+
 Verify the number of districts (1228) and campuses (8555):
 
     csvcut --columns=CAMPUS  data/2013/CREF.txt | wc -l
@@ -33,6 +36,7 @@ import csv
 import sys
 
 from elasticsearch import Elasticsearch
+from elasticsearch.helpers import scan
 from elasticsearch_dsl import Search, Q
 
 
@@ -42,6 +46,16 @@ RACES = ['asian', 'black', 'hispanic', 'native-american', 'white',
 GROUPS = ['at-risk', 'economically-disadvantaged', 'gifted-and-talented',
           'limited-english-proficient', 'non-educationally-disadvantaged']
 
+WIDE_INDEX = 'aeis-wide'
+
+# The datasets of enrollment and names: the 2013 profile, and the student
+# data of earlier years
+DATASETS = ('prof', 'stud')
+
+# Wide measures of total enrollment, and of enrollment by race or group
+ENROLLMENT = {'field': 'enrollment', 'group': 'all', 'measure': 'count'}
+GROUP_ENROLLMENT = {'field': 'enrollment', 'measure': 'count'}
+
 
 def set_value(mapping, key, value):
     """
@@ -146,9 +160,81 @@ def get_group_counts_by_campus(client, version=2013):
     return group_counts_by_campus
 
 
-def write_district_enrollment(client):
-    enrollment_by_district = get_enrollment_by_district(client)
-    district_names = get_district_names(client)
+def get_measures_by_entity(client, level, selectors, fields=(),
+                           version=2013, datasets=DATASETS):
+    """
+    Get the measures of each entity at `level` from the wide layout that
+    match any of `selectors` (dicts of facet values), merged across its
+    datasets.
+
+    Measures aren't indexed, so they can't be queried, but only the
+    documents of `datasets` are scanned, only the facets in `selectors`
+    and `fields` are fetched, and only the matching measures are kept.
+    """
+    facets = set(['value']).union(fields, *selectors)
+    query = {'match': {'version': version}}
+    if datasets:
+        query = {'filtered': {
+            'query': query,
+            'filter': {'terms': {'dataset': list(datasets)}},
+        }}
+
+    measures_by_entity = collections.defaultdict(list)
+    hits = scan(client, index=WIDE_INDEX, doc_type=level, query={
+        'query': query,
+        '_source': ['key'] + ['measures.' + f for f in sorted(facets)],
+    })
+    for hit in hits:
+        source = hit['_source']
+        measures = measures_by_entity[source['key']]
+        for measure in source.get('measures', ()):
+            if any(matches(measure, s) for s in selectors):
+                measures.append(measure)
+
+    return measures_by_entity
+
+
+def matches(measure, facets):
+    return all(measure.get(f) == v for f, v in facets.iteritems())
+
+
+def iter_measures(measures, **facets):
+    for measure in measures:
+        if matches(measure, facets):
+            yield measure
+
+
+def get_wide_values(measures_by_entity, **facets):
+    values = {}
+    for key, measures in measures_by_entity.iteritems():
+        for measure in iter_measures(measures, **facets):
+            set_value(values, key, measure['value'])
+
+    return values
+
+
+def get_wide_group_counts(measures_by_entity):
+    group_counts_by_entity = collections.defaultdict(dict)
+    for key, measures in measures_by_entity.iteritems():
+        group_counts = group_counts_by_entity[key]
+        for measure in iter_measures(measures, **GROUP_ENROLLMENT):
+            if measure.get('race', 'all') != 'all':
+                set_value(group_counts, measure['race'], measure['value'])
+            elif measure.get('group', 'all') != 'all':
+                set_value(group_counts, measure['group'], measure['value'])
+
+    return group_counts_by_entity
+
+
+def write_district_enrollment(client, wide=False):
+    if wide:
+        districts = get_measures_by_entity(
+            client, 'district', [ENROLLMENT, {'column': 'DISTNAME'}])
+        enrollment_by_district = get_wide_values(districts, **ENROLLMENT)
+        district_names = get_wide_values(districts, column='DISTNAME')
+    else:
+        enrollment_by_district = get_enrollment_by_district(client)
+        district_names = get_district_names(client)
 
     writer = csv.writer(sys.stdout)
     header = ['key', 'name', 'enrollment']
@@ -159,11 +245,22 @@ def write_district_enrollment(client):
         writer.writerow(row)
 
 
-def write_campus_enrollment(client):
-    enrollment_by_campus = get_enrollment_by_campus(client)
-    group_counts_by_campus = get_group_counts_by_campus(client)
-    campus_names = get_campus_names(client)
-    district_names = get_district_names(client)
+def write_campus_enrollment(client, wide=False):
+    if wide:
+        campuses = get_measures_by_entity(
+            client, 'campus', [GROUP_ENROLLMENT, {'column': 'CAMPNAME'}],
+            fields=['group', 'race'])
+        enrollment_by_campus = get_wide_values(campuses, **ENROLLMENT)
+        group_counts_by_campus = get_wide_group_counts(campuses)
+        campus_names = get_wide_values(campuses, column='CAMPNAME')
+        districts = get_measures_by_entity(client, 'district',
+                                           [{'column': 'DISTNAME'}])
+        district_names = get_wide_values(districts, column='DISTNAME')
+    else:
+        enrollment_by_campus = get_enrollment_by_campus(client)
+        group_counts_by_campus = get_group_counts_by_campus(client)
+        campus_names = get_campus_names(client)
+        district_names = get_district_names(client)
 
     writer = csv.writer(sys.stdout)
     header = ['key', 'name', 'district', 'enrollment'] + RACES + GROUPS
@@ -190,11 +287,12 @@ def write_campus_enrollment(client):
 
 def main():
     client = Elasticsearch()
+    wide = '--wide' in sys.argv
     if '--district' in sys.argv:
-        write_district_enrollment(client)
+        write_district_enrollment(client, wide=wide)
         exit()
     elif '--campus' in sys.argv:
-        write_campus_enrollment(client)
+        write_campus_enrollment(client, wide=wide)
         exit()
 
 